@@ -3,8 +3,20 @@ if [ -z "$SECRET_KEY" ]; then
     exit 1
 fi
 
+# the setup commands run before the schema is current, only the server checks its startup
+STARTUP_CHECKS_SETTING="${STARTUP_CHECKS:-true}"
+export STARTUP_CHECKS=false
 flask db init
 flask db migrate
+REVISION_BEFORE="$(flask db current 2>/dev/null)"
 flask db upgrade
+# fills normalized item keys added by the upgrade and merges items that only differ in case or spacing
+flask normalize-items
+# backfills aggregates added by an upgrade (e.g. item availability); boots without a migration skip it
+if [ "$(flask db current 2>/dev/null)" != "$REVISION_BEFORE" ]; then
+    flask rebuild-aggregates
+fi
+flask fail-interrupted-jobs
 
+export STARTUP_CHECKS="$STARTUP_CHECKS_SETTING"
 exec "$@"
\ No newline at end of file
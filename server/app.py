@@ -8,6 +8,8 @@ from flask_bcrypt import Bcrypt
 import os
 import logging
 from dotenv import load_dotenv
+from sessions import RoutingSession, READ_BIND, read_only_uri, register_read_routing
+from querylog import register_query_log
 
 load_dotenv()
 
@@ -19,7 +21,7 @@ convention = {
     "pk": "pk_%(table_name)s"
 }
 metadata = MetaData(naming_convention=convention)
-db = SQLAlchemy(metadata=metadata)
+db = SQLAlchemy(metadata=metadata, session_options={'class_': RoutingSession})
 bcrypt = Bcrypt()
 
 def create_app():
@@ -33,6 +35,10 @@ def create_app():
     app.logger.setLevel(logging.INFO)
     
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///./inventory.db'
+    # GET requests read through a separate read-only engine: a replica DSN, or the SQLite file opened with mode=ro
+    read_uri = os.getenv('READ_DATABASE_URI') or read_only_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+    if read_uri:
+        app.config['SQLALCHEMY_BINDS'] = {READ_BIND: read_uri}
     app.config['CORS_HEADERS'] = 'Content-Type'
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
     app.config['SESSION_TYPE'] = 'filesystem'
@@ -40,15 +46,56 @@ def create_app():
     app.config['SESSION_COOKIE_SECURE'] = False  # Set to True in production with HTTPS
     app.config['SESSION_COOKIE_HTTPONLY'] = True
     app.config['SESSION_COOKIE_NAME'] = 'session'
+    app.config['TRANSACTION_RETENTION_DAYS'] = int(os.getenv('TRANSACTION_RETENTION_DAYS', 365 * 2))
+    app.config['ARCHIVE_DIR'] = os.getenv('ARCHIVE_DIR', os.path.join(app.instance_path, 'archive'))
+    app.config['COMPRESS_MIN_SIZE'] = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+    app.config['COMPRESS_LEVEL'] = int(os.getenv('COMPRESS_LEVEL', 6))
+    app.config['GROUP_COMMIT'] = os.getenv('GROUP_COMMIT', 'false').lower() in ('1', 'true', 'yes')
+    app.config['GROUP_COMMIT_INTERVAL_MS'] = int(os.getenv('GROUP_COMMIT_INTERVAL_MS', 5))
+    app.config['EVENTS_MAX_SUBSCRIBERS'] = int(os.getenv('EVENTS_MAX_SUBSCRIBERS', 48))
+    app.config['SLOW_QUERY_MS'] = int(os.getenv('SLOW_QUERY_MS', 100))
+    app.config['SLOW_QUERY_EXPLAIN'] = os.getenv('SLOW_QUERY_EXPLAIN', 'true').lower() in ('1', 'true', 'yes')
+    app.config['STARTUP_CHECKS'] = os.getenv('STARTUP_CHECKS', 'true').lower() in ('1', 'true', 'yes')
+    app.config['WARM_UP_ON_START'] = os.getenv('WARM_UP_ON_START', 'true').lower() in ('1', 'true', 'yes')
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS', 2))
+    app.config['JOB_DIR'] = os.getenv('JOB_DIR', os.path.join(app.instance_path, 'jobs'))
+    app.config['JOB_HEARTBEAT_SECONDS'] = int(os.getenv('JOB_HEARTBEAT_SECONDS', 10))
+    app.config['JOB_LEASE_SECONDS'] = int(os.getenv('JOB_LEASE_SECONDS', 60))
+    app.config['JOB_RESULT_TTL_SECONDS'] = int(os.getenv('JOB_RESULT_TTL_SECONDS', 7 * 24 * 3600))
+    app.config['BACKUP_DIR'] = os.getenv('BACKUP_DIR', os.path.join(app.instance_path, 'backups'))
+    app.config['BACKUP_KEEP'] = int(os.getenv('BACKUP_KEEP', 7))
+    app.config['BACKUP_RETRIES'] = int(os.getenv('BACKUP_RETRIES', 3))
+    app.config['BACKUP_RETRY_SLEEP_MS'] = int(os.getenv('BACKUP_RETRY_SLEEP_MS', 1000))
+    app.config['PROFILER'] = os.getenv('PROFILER', 'cprofile')
+    app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
     
     db.init_app(app)
     bcrypt.init_app(app)
+    register_read_routing(app, db)
+    register_query_log(app, db)
     
     from routes import register_routes
+    from commands import register_commands
+    from responses import register_responses
+    from profiling import register_profiling
     
     register_routes(app, db, bcrypt)
+    register_commands(app, db)
+    register_responses(app)
+    register_profiling(app)
+
+    from jobs import init_job_runner
+    init_job_runner(app)
+
+    if app.config['GROUP_COMMIT']:
+        from group_commit import init_group_commit
+        init_group_commit(app)
     
     Migrate(app, db)
+
+    # after Migrate: the startup checks compare the database with its migrations directory
+    from health import register_health
+    register_health(app, db)
     CORS(app, resources={
         r"/*": {
             "origins": ["http://localhost:5173", "http://localhost:3000", "http://127.0.0.1:5173", "http://127.0.0.1:3000"],
@@ -0,0 +1,173 @@
+from datetime import datetime
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import time
+
+PAGE_NUMBER = struct.Struct('>I')
+
+def sqlite_database_path(url):
+    """
+    Returns the file of a SQLite database URL. Raises ValueError for other databases.
+    """
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        raise ValueError('Online backups need a file based SQLite database, back up other databases with their own tools (e.g. pg_dump)')
+    return url.database
+
+def online_copy(source_path, target_path, retries=3, retry_sleep=1.0, progress=None):
+    """
+    Copies a live SQLite database with the online backup API in a single step, which reads one
+    consistent snapshot. A copy made in several steps starts over whenever another connection
+    writes in between, so under steady writes it would never finish. In WAL mode writers go on
+    during the step; with a rollback journal they wait for it. A step that cannot get its read
+    lock is retried retries times, retry_sleep seconds apart, before the error is raised.
+    """
+    for attempt in range(retries + 1):
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=-1, progress=progress)
+            return target.execute('PRAGMA page_size').fetchone()[0]
+        except sqlite3.OperationalError:
+            if attempt == retries:
+                raise
+        finally:
+            target.close()
+            source.close()
+        time.sleep(retry_sleep)
+
+def page_hashes(path, page_size):
+    with open(path, 'rb') as f:
+        return [hashlib.blake2b(page, digest_size=16).hexdigest() for page in iter(lambda: f.read(page_size), b'')]
+
+def backup_name(source_path):
+    return os.path.splitext(os.path.basename(source_path))[0]
+
+def full_backups(directory, name):
+    """Returns the full backups of name in directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(directory, entry) for entry in os.listdir(directory)
+        if entry.startswith(f"{name}-") and entry.endswith('.db.gz')
+    )
+
+def manifest_path(full_path):
+    return full_path[:-len('.db.gz')] + '.pages.json'
+
+def write_full(copy_path, path, page_size, hashes):
+    with open(copy_path, 'rb') as source, gzip.open(path, 'xb') as target:
+        shutil.copyfileobj(source, target)
+    with open(manifest_path(path), 'x') as f:
+        json.dump({'page_size': page_size, 'pages': hashes}, f)
+
+def write_diff(copy_path, path, base_path, page_size, hashes, base_hashes):
+    """
+    Writes the pages that differ from the base backup: a JSON header line, then
+    a big-endian page number followed by the page for every changed page.
+    """
+    changed = [number for number, digest in enumerate(hashes) if number >= len(base_hashes) or digest != base_hashes[number]]
+    header = {'base': os.path.basename(base_path), 'page_size': page_size, 'page_count': len(hashes), 'changed': len(changed)}
+    with open(copy_path, 'rb') as source, gzip.open(path, 'xb') as target:
+        target.write((json.dumps(header) + '\n').encode('utf-8'))
+        for number in changed:
+            source.seek(number * page_size)
+            target.write(PAGE_NUMBER.pack(number))
+            target.write(source.read(page_size))
+    return len(changed)
+
+BACKUP_SUFFIXES = ('.db.gz', '.pages.json', '.diff.gz')
+
+def backup_stem(entry):
+    """Returns the name-timestamp part of a backup file, or None for other files."""
+    for suffix in BACKUP_SUFFIXES:
+        if entry.endswith(suffix):
+            return entry[:-len(suffix)]
+    return None
+
+def rotate(directory, name, keep):
+    """
+    Keeps the newest keep full backups and the differential backups taken after the oldest of them.
+    """
+    fulls = full_backups(directory, name)
+    if len(fulls) <= keep:
+        return []
+    oldest_kept = os.path.basename(fulls[-keep])[:-len('.db.gz')]
+
+    removed = []
+    for entry in sorted(os.listdir(directory)):
+        stem = backup_stem(entry)
+        if stem is None or not entry.startswith(f"{name}-"):
+            continue
+        # names embed a sortable timestamp, so everything older than the oldest kept full backup goes;
+        # the database name itself may contain dots, only the known suffixes are stripped
+        if stem < oldest_kept:
+            os.remove(os.path.join(directory, entry))
+            removed.append(entry)
+    return removed
+
+def backup_database(source_path, directory, incremental=False, keep=7, retries=3, retry_sleep=1.0, progress=None):
+    """
+    Backs up the SQLite database at source_path into directory without stopping writers.
+    A full backup is a gzip-compressed copy plus a manifest of page hashes. An incremental
+    backup only holds the pages that changed since the newest full backup, and falls back
+    to a full backup when there is none.
+    Returns (path of the backup, number of pages written).
+    """
+    os.makedirs(directory, exist_ok=True)
+    name = backup_name(source_path)
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+
+    fd, copy_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    os.close(fd)
+    try:
+        page_size = online_copy(source_path, copy_path, retries=retries, retry_sleep=retry_sleep, progress=progress)
+        hashes = page_hashes(copy_path, page_size)
+
+        fulls = full_backups(directory, name)
+        base = None
+        if incremental and fulls:
+            with open(manifest_path(fulls[-1])) as f:
+                base = json.load(f)
+            if base['page_size'] != page_size:
+                base = None
+
+        if base is not None:
+            path = os.path.join(directory, f"{name}-{stamp}.diff.gz")
+            written = write_diff(copy_path, path, fulls[-1], page_size, hashes, base['pages'])
+        else:
+            path = os.path.join(directory, f"{name}-{stamp}.db.gz")
+            write_full(copy_path, path, page_size, hashes)
+            written = len(hashes)
+    finally:
+        os.remove(copy_path)
+
+    rotate(directory, name, keep)
+    return path, written
+
+def restore_backup(full_path, target_path, diff_path=None):
+    """
+    Writes the database of a full backup, optionally brought forward by one of its
+    differential backups, to target_path. The server must not be running on target_path.
+    Raises ValueError when the differential backup belongs to another full backup.
+    """
+    with gzip.open(full_path, 'rb') as source, open(target_path, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    if not diff_path:
+        return
+
+    with gzip.open(diff_path, 'rb') as diff:
+        header = json.loads(diff.readline())
+        if header['base'] != os.path.basename(full_path):
+            raise ValueError(f"{os.path.basename(diff_path)} was taken against {header['base']}, not {os.path.basename(full_path)}")
+        page_size = header['page_size']
+        with open(target_path, 'r+b') as target:
+            while number := diff.read(PAGE_NUMBER.size):
+                target.seek(PAGE_NUMBER.unpack(number)[0] * page_size)
+                target.write(diff.read(page_size))
+            target.truncate(header['page_count'] * page_size)
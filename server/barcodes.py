@@ -0,0 +1,49 @@
+from app import db
+from models import Item, Box
+from stock import current_version
+from sqlalchemy import select, literal, union_all
+import threading
+
+class BarcodeMap:
+    """
+    Per-worker map of barcode to ('box', bid) or ('item', iid).
+    The map is dropped whenever the shared 'barcodes' data version moves, which every
+    barcode write bumps, and codes missing from it are looked up with one set-based query.
+    """
+    def __init__(self):
+        self._codes = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        with self._lock:
+            self._codes = {}
+            self._version = None
+
+    def _lookup(self, codes):
+        boxes = select(Box.barcode, literal('box'), Box.bid).where(Box.barcode.in_(codes))
+        items = select(Item.barcode, literal('item'), Item.iid).where(Item.barcode.in_(codes))
+        return {code: (kind, id) for code, kind, id in db.session.execute(union_all(boxes, items))}
+
+    def resolve(self, codes):
+        """
+        Returns a dict mapping each known code to (kind, id). Unknown codes are left out.
+        """
+        version = current_version('barcodes')
+        with self._lock:
+            if version != self._version:
+                self._codes = {}
+                self._version = version
+            resolved = {code: self._codes[code] for code in codes if code in self._codes}
+
+        missing = [code for code in set(codes) if code not in resolved]
+        if missing:
+            found = self._lookup(missing)
+            with self._lock:
+                if version == self._version:
+                    self._codes.update(found)
+            resolved.update(found)
+
+        return resolved
+
+barcode_map = BarcodeMap()
@@ -0,0 +1,84 @@
+"""
+Benchmarks serialization time and bytes on the wire of /api/get_inventory.
+
+Usage (from the server directory):
+    python benchmarks/bench_inventory.py [--items 10000] [--repeat 20]
+"""
+import argparse
+import gzip
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from flask_bcrypt import Bcrypt
+from app import db
+from models import Item, Transaction
+from routes import register_routes
+from responses import OrjsonProvider, orjson, brotli
+
+def build_app(items):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = 'benchmark'
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    db.init_app(app)
+    register_routes(app, db, Bcrypt(app))
+
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(Item(iid=iid, description=f'item {iid:05d}') for iid in range(1, items + 1))
+        db.session.add_all(
+            Transaction(iid=iid, uid=1, transaction_type=transaction_type, quantity=iid % 7 + 1)
+            for iid in range(1, items + 1)
+            for transaction_type in ('purchase', 'borrow')
+        )
+        db.session.commit()
+    return app
+
+def timed(function, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    app = build_app(args.items)
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['user_id'] = 1
+    payload = client.get('/api/get_inventory').get_json()
+
+    providers = [('stdlib json', DefaultJSONProvider(app))]
+    if orjson:
+        providers.append(('orjson', OrjsonProvider(app)))
+    else:
+        print('orjson is not installed, only the stdlib provider is measured')
+
+    print(f"get_inventory with {args.items} items")
+    for name, provider in providers:
+        seconds, body = timed(lambda: provider.dumps(payload), args.repeat)
+        print(f"  {name:<12} serialize {seconds * 1000:8.2f} ms  {len(body.encode('utf-8')):>9} bytes")
+
+    raw = DefaultJSONProvider(app).dumps(payload).encode('utf-8')
+    encodings = [('gzip', lambda: gzip.compress(raw, compresslevel=6))]
+    if brotli:
+        encodings.append(('br', lambda: brotli.compress(raw, quality=6)))
+    else:
+        print('brotli is not installed, only gzip is measured')
+
+    for name, function in encodings:
+        seconds, body = timed(function, args.repeat)
+        print(f"  {name:<12} compress  {seconds * 1000:8.2f} ms  {len(body):>9} bytes ({len(body) / len(raw):.1%} of {len(raw)})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Benchmarks reading an item's history as ORM instances against column-only rows,
+the way /api/item/<item_description> used to and now does.
+
+Usage (from the server directory):
+    python benchmarks/bench_read_path.py [--transactions 200000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from datetime import datetime, timedelta
+from flask import Flask
+from sqlalchemy import select
+from app import db
+from models import Item, Transaction, TRANSACTION_TYPES
+
+def build_app(transactions):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    db.init_app(app)
+
+    start = datetime(2020, 1, 1)
+    with app.app_context():
+        db.create_all()
+        db.session.add(Item(iid=1, description='tent'))
+        db.session.execute(Transaction.__table__.insert(), [{
+            'iid': 1,
+            'uid': 1,
+            'transaction_type': TRANSACTION_TYPES[tid % len(TRANSACTION_TYPES)],
+            'quantity': tid % 7 + 1,
+            'date': start + timedelta(minutes=tid),
+        } for tid in range(1, transactions + 1)])
+        db.session.commit()
+    return app
+
+def serialize(rows):
+    return [{
+        'id': row.tid,
+        'transaction_type': row.transaction_type,
+        'quantity': row.quantity,
+        'date': row.date.isoformat() if row.date else None,
+    } for row in rows]
+
+def orm_history():
+    return serialize(Transaction.query.filter_by(iid=1).order_by(Transaction.date, Transaction.tid).all())
+
+def row_history():
+    statement = select(Transaction.tid, Transaction.transaction_type, Transaction.quantity, Transaction.date) \
+        .where(Transaction.iid == 1).order_by(Transaction.date, Transaction.tid)
+    return serialize(db.session.execute(statement))
+
+def measure(function, repeat):
+    """Returns (best seconds, peak traced bytes) of function, with a fresh session per run."""
+    best = float('inf')
+    for _ in range(repeat):
+        db.session.remove()
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+
+    db.session.remove()
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.session.remove()
+    return best, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transactions', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    app = build_app(args.transactions)
+    print(f"history of one item with {args.transactions} transactions")
+    with app.app_context():
+        for name, function in (('ORM instances', orm_history), ('column rows', row_history)):
+            seconds, peak = measure(function, args.repeat)
+            print(f"  {name:<14} {seconds * 1000:9.1f} ms  {seconds / args.transactions * 1e6:6.2f} us/row  "
+                  f"peak {peak / 2 ** 20:7.1f} MiB  {peak / args.transactions:6.0f} B/row")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import click
+import os
+from datetime import datetime, timedelta
+
+def register_commands(app, db):
+    @app.cli.command('snapshot')
+    def snapshot():
+        """Checkpoint the per-item stock totals. Meant to be run periodically (e.g. nightly from cron)."""
+        from stock import take_snapshot
+
+        count = take_snapshot()
+        app.logger.info(f"Stock snapshot taken for {count} items")
+        click.echo(f"Snapshot taken for {count} items")
+
+    @app.cli.command('compact')
+    @click.option('--days', type=int, default=None, help='Retention window in days, defaults to TRANSACTION_RETENTION_DAYS.')
+    def compact(days):
+        """Fold transactions older than the retention window into carry-forward rows and archive the originals."""
+        from compaction import compact_transactions
+
+        days = days if days is not None else app.config['TRANSACTION_RETENTION_DAYS']
+        cutoff = datetime.now() - timedelta(days=days)
+        path, folded = compact_transactions(cutoff, app.config['ARCHIVE_DIR'])
+        if not path:
+            click.echo("Nothing to compact")
+            return
+        app.logger.info(f"Compacted {folded} transactions older than {cutoff:%Y-%m-%d} into {path}")
+        click.echo(f"Compacted {folded} transactions, originals archived to {path}")
+
+    @app.cli.command('restore-archive')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    def restore(path):
+        """Restore the original transactions from an archive written by 'flask compact'."""
+        from compaction import restore_archive
+
+        try:
+            count = restore_archive(path)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        app.logger.info(f"Restored {count} transactions from {path}")
+        click.echo(f"Restored {count} transactions")
+
+    @app.cli.command('rebuild-aggregates')
+    def rebuild():
+        """Recompute the incrementally maintained aggregates (loan balances, ...) from the transaction log."""
+        from stock import rebuild_aggregates
+
+        rebuild_aggregates()
+        app.logger.info("Rebuilt aggregates from the transaction log")
+        click.echo("Aggregates rebuilt")
+
+    @app.cli.command('normalize-items')
+    def normalize():
+        """Backfill the normalized item keys and merge items whose descriptions only differ in case or spacing."""
+        from item_keys import normalize_items
+
+        updated, merged = normalize_items()
+        app.logger.info(f"Set {updated} item keys, merged {merged} duplicate items")
+        click.echo(f"Set {updated} item keys, merged {merged} duplicate items")
+
+    @app.cli.command('fail-interrupted-jobs')
+    def fail_interrupted():
+        """Mark background jobs left queued or running by a stopped server as failed. Run before the server starts."""
+        from jobs import fail_interrupted_jobs
+
+        count = fail_interrupted_jobs()
+        if count:
+            app.logger.info(f"Marked {count} interrupted jobs as failed")
+        click.echo(f"Marked {count} interrupted jobs as failed")
+
+    @app.cli.command('backup')
+    @click.option('--incremental', is_flag=True, help='Only store the pages changed since the newest full backup.')
+    @click.option('--keep', type=int, default=None, help='Number of full backups to keep, defaults to BACKUP_KEEP.')
+    def backup(incremental, keep):
+        """Back up the live SQLite database into BACKUP_DIR without stopping the server."""
+        from backup import backup_database, sqlite_database_path
+
+        try:
+            source = sqlite_database_path(db.engine.url)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        path, pages = backup_database(
+            source,
+            app.config['BACKUP_DIR'],
+            incremental=incremental,
+            keep=keep if keep is not None else app.config['BACKUP_KEEP'],
+            retries=app.config['BACKUP_RETRIES'],
+            retry_sleep=app.config['BACKUP_RETRY_SLEEP_MS'] / 1000
+        )
+        app.logger.info(f"Backed up {pages} pages to {path}")
+        click.echo(f"Backed up {pages} pages to {path}")
+
+    @app.cli.command('restore-backup')
+    @click.argument('full', type=click.Path(exists=True, dir_okay=False))
+    @click.argument('target', type=click.Path(dir_okay=False))
+    @click.option('--diff', type=click.Path(exists=True, dir_okay=False), help='Differential backup to apply on top of FULL.')
+    def restore_database(full, target, diff):
+        """Write the database of a full backup, optionally with a differential backup applied, to TARGET."""
+        from backup import restore_backup
+
+        if os.path.exists(target):
+            raise click.ClickException(f"{target} exists, restore to a new file and swap it in while the server is stopped")
+        try:
+            restore_backup(full, target, diff)
+        except ValueError as e:
+            os.remove(target)
+            raise click.ClickException(str(e))
+        click.echo(f"Restored {full}{f' with {diff}' if diff else ''} to {target}")
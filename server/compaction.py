@@ -0,0 +1,109 @@
+from app import db
+from models import Transaction, StockSnapshot
+from datetime import datetime
+from collections import defaultdict
+import gzip
+import json
+import os
+
+def serialize_transaction(transaction, carry_tid):
+    return {
+        'tid': transaction.tid,
+        'iid': transaction.iid,
+        'uid': transaction.uid,
+        'transaction_type': transaction.transaction_type,
+        'quantity': transaction.quantity,
+        'date': transaction.date.isoformat() if transaction.date else None,
+        'compacted': transaction.compacted,
+        'lid': transaction.lid,
+        'carry_tid': carry_tid,
+    }
+
+def compact_transactions(cutoff, archive_dir):
+    """
+    Folds the transactions dated before cutoff into one carry-forward row per
+    (item, user, transaction type, location). The carry-forward row reuses the highest tid of
+    its group, so stock totals and snapshot watermarks stay exact.
+    The original rows are written to a new gzip-compressed JSON lines file in
+    archive_dir before they are removed from the table.
+    Returns (path of the archive or None, number of rows folded).
+    """
+    transactions = Transaction.query.filter(Transaction.date < cutoff).order_by(Transaction.tid).all()
+
+    groups = defaultdict(list)
+    for transaction in transactions:
+        groups[(transaction.iid, transaction.uid, transaction.transaction_type, transaction.lid)].append(transaction)
+    groups = [group for group in groups.values() if len(group) > 1]
+
+    if not groups:
+        return None, 0
+
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"transactions-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}.jsonl.gz")
+
+    # archive files are append-only: 'xb' refuses to overwrite an existing archive
+    with gzip.open(path, 'xb') as archive:
+        for group in groups:
+            carry_tid = group[-1].tid
+            for transaction in group:
+                archive.write((json.dumps(serialize_transaction(transaction, carry_tid)) + '\n').encode('utf-8'))
+
+    folded = 0
+    try:
+        for group in groups:
+            carry = group[-1]
+            carry.quantity = sum(transaction.quantity for transaction in group)
+            carry.date = max(transaction.date for transaction in group)
+            carry.compacted = True
+            for transaction in group[:-1]:
+                db.session.delete(transaction)
+            folded += len(group)
+
+        # snapshots that stop inside a folded group would count the carry-forward row twice
+        max_carry_tid = max(group[-1].tid for group in groups)
+        StockSnapshot.query.filter(StockSnapshot.last_tid < max_carry_tid).delete()
+
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        os.remove(path)
+        raise
+
+    return path, folded
+
+def restore_archive(path):
+    """
+    Puts the original rows of an archive back in place of their carry-forward rows.
+    Archives must be restored newest first when a carry-forward row was folded again later.
+    Raises ValueError when the carry-forward rows no longer match the archive.
+    Returns the number of rows restored.
+    """
+    groups = defaultdict(list)
+    with gzip.open(path, 'rt', encoding='utf-8') as archive:
+        for line in archive:
+            row = json.loads(line)
+            groups[row['carry_tid']].append(row)
+
+    for carry_tid, rows in groups.items():
+        carry = db.session.get(Transaction, carry_tid)
+        if not carry or not carry.compacted or carry.quantity != sum(row['quantity'] for row in rows):
+            db.session.rollback()
+            raise ValueError(f"Carry-forward transaction {carry_tid} does not match the archive, restore newer archives first")
+
+        db.session.delete(carry)
+        db.session.flush()
+        for row in rows:
+            db.session.add(Transaction(
+                tid=row['tid'],
+                iid=row['iid'],
+                uid=row['uid'],
+                transaction_type=row['transaction_type'],
+                quantity=row['quantity'],
+                date=datetime.fromisoformat(row['date']) if row['date'] else None,
+                compacted=row['compacted'],
+                # archives written before locations existed have no lid
+                lid=row.get('lid'),
+            ))
+    db.session.commit()
+
+    return sum(len(rows) for rows in groups.values())
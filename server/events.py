@@ -0,0 +1,90 @@
+from app import db
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from collections import deque
+import threading
+import uuid
+
+class ChangeFeed:
+    """
+    Broadcasts inventory change events to every subscriber in this process.
+    Events live in one shared bounded buffer and subscribers only remember the last
+    sequence number they saw, so publishing costs the same for one or many subscribers.
+    Sequence numbers start over in every process, the epoch tells them apart.
+    """
+    def __init__(self, size=1000):
+        self.epoch = uuid.uuid4().hex[:12]
+        self._events = deque(maxlen=size)
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self.subscribers = 0
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    def subscribe(self, limit):
+        """
+        Counts a new subscriber unless limit subscribers are already connected.
+        Returns whether the subscriber was admitted; admitted subscribers must unsubscribe.
+        """
+        with self._condition:
+            if self.subscribers >= limit:
+                return False
+            self.subscribers += 1
+            return True
+
+    def unsubscribe(self):
+        with self._condition:
+            self.subscribers -= 1
+
+    def event_id(self, sequence):
+        return f"{self.epoch}-{sequence}"
+
+    def parse_event_id(self, event_id):
+        """
+        Returns the sequence number of an event id of this feed, or None for ids of
+        another process or an earlier run, whose sequence numbers mean nothing here.
+        """
+        epoch, _, sequence = (event_id or '').rpartition('-')
+        if epoch != self.epoch or not sequence.isdigit() or int(sequence) > self._sequence:
+            return None
+        return int(sequence)
+
+    def publish(self, events):
+        with self._condition:
+            for change in events:
+                self._sequence += 1
+                self._events.append((self._sequence, change))
+            self._condition.notify_all()
+
+    def wait(self, after, timeout=None):
+        """
+        Blocks until there are events newer than after, or until timeout.
+        Returns the list of (sequence, event) newer than after, or None when
+        subscribers that far behind can no longer be caught up from the buffer.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence > after, timeout)
+            if self._events and self._events[0][0] > after + 1:
+                return None
+            return [(sequence, change) for sequence, change in self._events if sequence > after]
+
+feed = ChangeFeed()
+
+def queue_event(change):
+    """
+    Queues a change event on the current session. It is published once the session
+    commits and dropped when it rolls back.
+    """
+    db.session.info.setdefault('feed_events', []).append(change)
+
+@event.listens_for(Session, 'after_commit')
+def publish_queued_events(session):
+    events = session.info.pop('feed_events', None)
+    if events:
+        feed.publish(events)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def drop_queued_events(session, previous_transaction):
+    session.info.pop('feed_events', None)
@@ -0,0 +1,88 @@
+from app import db
+from models import Transaction
+from stock import record_transaction
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+class GroupCommitWriter:
+    """
+    Single writer thread that drains queued transaction inserts and commits them together,
+    trading a few milliseconds of latency for one commit (and one fsync) per group.
+    Futures are resolved with the new tid only after the commit, so a request is
+    acknowledged once its row is durable. A future cancelled while still queued
+    withdraws its row; once the writer has taken it, it can no longer be cancelled.
+    """
+    def __init__(self, app, interval=0.005, max_batch=500):
+        self.app = app
+        self.interval = interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, **values):
+        future = Future()
+        self._queue.put((values, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _insert(self, values):
+        transaction = Transaction(**values)
+        db.session.add(transaction)
+        # record_transaction flushes, which assigns the tid
+        record_transaction(transaction)
+        return transaction.tid
+
+    def _write(self, batch):
+        # requests that timed out withdrew their row by cancelling its future
+        batch = [(values, future) for values, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        with self.app.app_context():
+            try:
+                tids = [self._insert(values) for values, future in batch]
+                db.session.commit()
+                for (values, future), tid in zip(batch, tids):
+                    future.set_result(tid)
+            except Exception:
+                db.session.rollback()
+                # one bad row must not fail its whole group: retry them one by one
+                for values, future in batch:
+                    try:
+                        tid = self._insert(values)
+                        db.session.commit()
+                        future.set_result(tid)
+                    except Exception as e:
+                        db.session.rollback()
+                        future.set_exception(e)
+            finally:
+                db.session.remove()
+
+def init_group_commit(app):
+    writer = GroupCommitWriter(
+        app,
+        interval=app.config.get('GROUP_COMMIT_INTERVAL_MS', 5) / 1000,
+        max_batch=app.config.get('GROUP_COMMIT_MAX_BATCH', 500)
+    )
+    writer.start()
+    app.extensions['group_commit'] = writer
+    return writer
@@ -0,0 +1,116 @@
+from models import Item, Box
+from stock import stock_totals
+from barcodes import barcode_map
+from sessions import mark_read_only
+from sqlalchemy import inspect, text, union_all, select
+import os
+import threading
+
+class Readiness:
+    """
+    Tracks the startup checks of a worker. The worker is ready once all of them passed.
+    """
+    def __init__(self):
+        self.checks = {}
+        self.error = None
+        self._ready = threading.Event()
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def mark_ready(self):
+        self._ready.set()
+
+    def status(self):
+        return {
+            'status': 'ready' if self.ready else ('failed' if self.error else 'starting'),
+            'checks': dict(self.checks),
+            'error': self.error,
+        }
+
+def open_connections(db):
+    for engine in db.engines.values():
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+
+def check_schema(app, db):
+    """
+    Raises RuntimeError when tables are missing or the database is not at the head migration.
+    """
+    missing = set(db.metadata.tables) - set(inspect(db.engine).get_table_names())
+    if missing:
+        raise RuntimeError(f"Missing tables: {', '.join(sorted(missing))}")
+
+    migrate = app.extensions.get('migrate')
+    directory = migrate.directory if migrate else None
+    if not directory or not os.path.isdir(os.path.join(directory, 'versions')):
+        return
+
+    from alembic.script import ScriptDirectory
+    heads = set(ScriptDirectory(directory).get_heads())
+    current = set(db.session.execute(text('SELECT version_num FROM alembic_version')).scalars())
+    if current != heads:
+        raise RuntimeError(f"Database is at revision {', '.join(sorted(current)) or 'none'}, expected {', '.join(sorted(heads))}")
+
+def warm_caches(db):
+    """
+    Runs the queries of the inventory read path on the engine GET requests use, so the first
+    inventory read does not pay for statement compilation, new connections and a cold page cache,
+    and fills the barcode map, the only in-process cache.
+    """
+    mark_read_only(db)
+    db.session.execute(select(Item.iid, Item.description)).all()
+    stock_totals()
+    codes = union_all(select(Item.barcode).where(Item.barcode.isnot(None)), select(Box.barcode))
+    barcode_map.resolve(list(db.session.execute(codes).scalars()))
+
+def warm_up(app, db, readiness, caches=True):
+    """
+    Runs the startup checks in order and marks the worker ready when all of them pass.
+    Warming the caches is optional, the connection and schema checks always run.
+    """
+    checks = [
+        ('connections', lambda: open_connections(db)),
+        ('schema', lambda: check_schema(app, db)),
+    ]
+    if caches:
+        checks.append(('caches', lambda: warm_caches(db)))
+    with app.app_context():
+        try:
+            for name, check in checks:
+                check()
+                readiness.checks[name] = 'ok'
+        except Exception as e:
+            app.logger.exception(f"Startup check {name} failed")
+            readiness.checks[name] = 'failed'
+            readiness.error = str(e)
+            return
+        finally:
+            db.session.remove()
+
+    readiness.mark_ready()
+    app.logger.info("Worker is ready")
+
+def register_health(app, db):
+    """
+    Adds /healthz (the process answers) and /readyz (startup checks passed) and starts
+    the startup checks in a background thread, so the worker accepts probes while warming up.
+    """
+    readiness = Readiness()
+    app.extensions['readiness'] = readiness
+
+    @app.route('/healthz', methods=['GET'])
+    def healthz():
+        return {'status': 'ok'}, 200
+
+    @app.route('/readyz', methods=['GET'])
+    def readyz():
+        return readiness.status(), 200 if readiness.ready else 503
+
+    # CLI commands run before the schema is migrated and never serve probes
+    if app.config.get('STARTUP_CHECKS', True):
+        caches = app.config.get('WARM_UP_ON_START', True)
+        threading.Thread(target=warm_up, args=(app, db, readiness, caches), name='warm-up', daemon=True).start()
+
+    return readiness
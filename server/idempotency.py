@@ -0,0 +1,178 @@
+from app import db
+from models import IdempotencyKey
+from flask import request, session, current_app, make_response
+from sqlalchemy.exc import IntegrityError
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from functools import wraps
+import hashlib
+import itertools
+import json
+import threading
+import time
+
+class ResponseCache:
+    """
+    Bounded, TTL-evicting per-worker cache of finished idempotent responses,
+    in front of the shared idempotency_keys table.
+    """
+    def __init__(self, size=1000, ttl=24 * 60 * 60):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+responses = ResponseCache()
+claims = itertools.count(1)
+
+# headers worth keeping besides the body, e.g. the Location of a queued job
+REPLAYED_HEADERS = ('Location',)
+
+def request_hash():
+    return hashlib.sha256(request.get_data()).hexdigest()
+
+def replay(status_code, body, mimetype=None, headers=None):
+    response = current_app.response_class(body, status=status_code, mimetype=mimetype or 'application/json')
+    response.headers.extend(headers or {})
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def same_request(row, digest):
+    # rows from before request_hash was stored only match on method and path
+    return row.method == request.method and row.path == request.path \
+        and row.request_hash in (None, digest)
+
+def from_row(row, digest):
+    if not same_request(row, digest):
+        return {'error': 'Idempotency-Key was already used for a different request'}, 422
+    if row.status_code is None:
+        return {'error': 'A request with this Idempotency-Key is still in progress'}, 409
+    return replay(row.status_code, row.body, row.mimetype, json.loads(row.headers or '{}'))
+
+def take_over(uid, key):
+    """
+    Claims an unfinished key whose first request has not answered within
+    IDEMPOTENCY_LEASE_SECONDS, e.g. because its worker was killed. At most one
+    of several retries racing for the key wins.
+    """
+    lease = current_app.config.get('IDEMPOTENCY_LEASE_SECONDS', 60)
+    count = IdempotencyKey.query.filter(
+        IdempotencyKey.uid == uid,
+        IdempotencyKey.key == key,
+        IdempotencyKey.status_code.is_(None),
+        IdempotencyKey.created_at < datetime.now() - timedelta(seconds=lease)
+    ).update({'created_at': datetime.now()}, synchronize_session=False)
+    db.session.commit()
+    return count == 1
+
+def claim(uid, key, digest):
+    """
+    Claims the key for the current request. Returns None once claimed,
+    otherwise the response to answer instead of running the route.
+    """
+    row = db.session.get(IdempotencyKey, (uid, key))
+    if row is None:
+        try:
+            db.session.add(IdempotencyKey(uid=uid, key=key, method=request.method, path=request.path,
+                                          request_hash=digest))
+            db.session.commit()
+            return None
+        except IntegrityError:
+            # another worker claimed the key first
+            db.session.rollback()
+            row = db.session.get(IdempotencyKey, (uid, key))
+
+    if row.status_code is None and same_request(row, digest) and take_over(uid, key):
+        return None
+    return from_row(row, digest)
+
+def evict():
+    """
+    Drops keys older than the TTL and, beyond the size bound, the oldest keys.
+    """
+    ttl = current_app.config.get('IDEMPOTENCY_TTL_SECONDS', 24 * 60 * 60)
+    limit = current_app.config.get('IDEMPOTENCY_MAX_KEYS', 10000)
+
+    IdempotencyKey.query.filter(IdempotencyKey.created_at < datetime.now() - timedelta(seconds=ttl)).delete()
+    oldest_kept = db.session.query(IdempotencyKey.created_at) \
+        .order_by(IdempotencyKey.created_at.desc()).offset(limit - 1).limit(1).scalar()
+    if oldest_kept is not None:
+        IdempotencyKey.query.filter(IdempotencyKey.created_at < oldest_kept).delete()
+    db.session.commit()
+
+def idempotent(f):
+    """
+    Makes a write route safe to retry. Requests carrying an Idempotency-Key header run once
+    per user and key; replays get the original response without running the route again.
+    Must be applied below login_required.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return f(*args, **kwargs)
+
+        cache_key = (session['user_id'], key)
+        digest = request_hash()
+        cached = responses.get(cache_key)
+        if cached is not None:
+            method, path, cached_digest, status_code, body, mimetype, headers = cached
+            if (method, path, cached_digest) == (request.method, request.path, digest):
+                return replay(status_code, body, mimetype, headers)
+
+        answer = claim(cache_key[0], key, digest)
+        if answer is not None:
+            return answer
+
+        if next(claims) % current_app.config.get('IDEMPOTENCY_EVICT_EVERY', 100) == 0:
+            evict()
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            IdempotencyKey.query.filter_by(uid=cache_key[0], key=key).delete()
+            db.session.commit()
+            raise
+
+        row = db.session.get(IdempotencyKey, cache_key)
+        if response.status_code >= 500:
+            # failures are not remembered, so the client can retry them
+            db.session.delete(row)
+        else:
+            headers = {name: response.headers[name] for name in REPLAYED_HEADERS if name in response.headers}
+            row.status_code = response.status_code
+            row.body = response.get_data(as_text=True)
+            row.mimetype = response.mimetype
+            row.headers = json.dumps(headers)
+            # must not replay keys the shared table has already evicted
+            ttl = current_app.config.get('IDEMPOTENCY_TTL_SECONDS', responses.ttl)
+            responses.put(cache_key, (request.method, request.path, digest, row.status_code, row.body,
+                                      row.mimetype, headers), ttl=ttl)
+        db.session.commit()
+
+        return response
+    return decorated_function
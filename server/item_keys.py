@@ -0,0 +1,71 @@
+from app import db
+from models import Item, Transaction, Content, ItemUse, LoanBalance, DailyUsage, LocationStock, StockSnapshot, normalize_key
+from stock import rebuild_aggregates, next_version, increment
+from collections import defaultdict
+from flask import current_app
+
+# rows pointing at an item that are moved to the item it is merged into
+ITEM_REFERENCES = (Transaction, Content, ItemUse)
+# per-item aggregates, rebuilt from the transaction log after a merge
+ITEM_AGGREGATES = (LoanBalance, LocationStock)
+
+def merge_item(duplicate, survivor):
+    for model in ITEM_REFERENCES:
+        model.query.filter_by(iid=duplicate.iid).update({'iid': survivor.iid}, synchronize_session=False)
+    for model in ITEM_AGGREGATES:
+        model.query.filter_by(iid=duplicate.iid).delete(synchronize_session=False)
+    # the rebuild keeps the daily usage of compacted days, which the log cannot give back, so it moves along
+    for usage in DailyUsage.query.filter_by(iid=duplicate.iid).all():
+        increment(DailyUsage, {'iid': survivor.iid, 'day': usage.day, 'transaction_type': usage.transaction_type},
+                  quantity=usage.quantity)
+    DailyUsage.query.filter_by(iid=duplicate.iid).delete(synchronize_session=False)
+
+    if duplicate.barcode:
+        barcode, duplicate.barcode = duplicate.barcode, None
+        db.session.flush()
+        if survivor.barcode is None:
+            survivor.barcode = barcode
+        else:
+            current_app.logger.warning(f"Dropped barcode {barcode} of item {duplicate.iid}, merged into {survivor.iid} which has its own")
+        next_version('barcodes')
+
+    current_app.logger.info(f"Merged item {duplicate.iid} ({duplicate.description!r}) into {survivor.iid} ({survivor.description!r})")
+    db.session.delete(duplicate)
+
+def normalize_items():
+    """
+    Backfills Item.key and merges the items whose descriptions only differ in case,
+    whitespace or Unicode form into the oldest of them, moving their transactions,
+    box contents and loans along. Aggregates are rebuilt when anything was merged.
+    Returns (number of keys set, number of items merged).
+    """
+    groups = defaultdict(list)
+    for item in Item.query.order_by(Item.iid):
+        groups[normalize_key(item.description)].append(item)
+
+    merged = 0
+    for key, items in groups.items():
+        for duplicate in items[1:]:
+            merge_item(duplicate, items[0])
+            merged += 1
+    # the duplicates must be gone before their key is given to the survivor
+    db.session.flush()
+
+    updated = 0
+    for key, items in groups.items():
+        survivor = items[0]
+        if survivor.key != key:
+            survivor.key = key
+            updated += 1
+        if len(items) > 1:
+            survivor.version = next_version()
+
+    if merged:
+        # snapshot rows of the survivors do not include the merged items' totals
+        StockSnapshot.query.delete(synchronize_session=False)
+    db.session.commit()
+
+    if merged:
+        rebuild_aggregates()
+
+    return updated, merged
@@ -0,0 +1,262 @@
+from app import db
+from models import Job, Item, User, Location, Transaction
+from stock import rebuild_aggregates, parse_as_of
+from reports import usage_report
+from backup import backup_database, sqlite_database_path
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from sqlalchemy import select, update
+import csv
+import json
+import os
+import threading
+import time
+
+class JobCancelled(Exception):
+    pass
+
+def export_transactions(params, path, checkpoint):
+    """
+    Writes the transaction log, optionally limited to params['from'] / params['to'], as CSV.
+    """
+    query = db.session.query(
+        Transaction.tid, Transaction.date, Item.description, User.username,
+        Transaction.transaction_type, Transaction.quantity, Location.name
+    ).join(Item, Item.iid == Transaction.iid) \
+        .join(User, User.uid == Transaction.uid) \
+        .outerjoin(Location, Location.lid == Transaction.lid)
+    if params.get('from'):
+        query = query.filter(Transaction.date >= datetime.fromisoformat(params['from']))
+    if params.get('to'):
+        query = query.filter(Transaction.date <= parse_as_of(params['to']))
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['tid', 'date', 'item', 'user', 'transaction_type', 'quantity', 'location'])
+        for count, row in enumerate(query.order_by(Transaction.tid).yield_per(1000), 1):
+            writer.writerow(row)
+            if count % 1000 == 0:
+                checkpoint()
+
+def run_usage_report(params, path, checkpoint):
+    filters = {}
+    if params.get('from'):
+        filters['start'] = date.fromisoformat(params['from'])
+    if params.get('to'):
+        filters['end'] = date.fromisoformat(params['to'])
+    if params.get('type'):
+        filters['transaction_type'] = params['type']
+    usage = usage_report(params.get('period', 'month'), **filters)
+
+    with open(path, 'w') as f:
+        json.dump({'usage': usage, 'count': len(usage)}, f)
+
+def run_rebuild_aggregates(params, path, checkpoint):
+    rebuild_aggregates()
+
+def run_backup(params, path, checkpoint):
+    config = current_app.config
+    backup, pages = backup_database(
+        sqlite_database_path(db.engine.url),
+        config.get('BACKUP_DIR') or os.path.join(current_app.instance_path, 'backups'),
+        incremental=bool(params.get('incremental')),
+        keep=config.get('BACKUP_KEEP', 7),
+        retries=config.get('BACKUP_RETRIES', 3),
+        retry_sleep=config.get('BACKUP_RETRY_SLEEP_MS', 1000) / 1000,
+        progress=lambda status, remaining, total: checkpoint()
+    )
+    with open(path, 'w') as f:
+        json.dump({'backup': os.path.basename(backup), 'pages': pages}, f)
+
+JobKind = namedtuple('JobKind', ['function', 'extension', 'mimetype', 'admin'])
+
+# extension None: the job has no result file
+JOB_KINDS = {
+    'export_transactions': JobKind(export_transactions, 'csv', 'text/csv', False),
+    'usage_report': JobKind(run_usage_report, 'json', 'application/json', False),
+    'rebuild_aggregates': JobKind(run_rebuild_aggregates, None, None, True),
+    'backup': JobKind(run_backup, 'json', 'application/json', True),
+}
+
+class JobRunner:
+    """
+    Runs jobs on a bounded thread pool, outside of the request that submitted them.
+    Job state lives in the jobs table, so any worker can report on or cancel any job.
+    Queued jobs are cancelled outright; running jobs stop at their next checkpoint.
+    While it has unfinished jobs the runner refreshes their heartbeat_at, so a reader
+    can tell a job whose worker process died from one that is still being worked on.
+    """
+    def __init__(self, app, max_workers=2, directory='jobs', heartbeat=10):
+        self.app = app
+        self.directory = directory
+        self.heartbeat = heartbeat
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._futures = {}
+        self._lock = threading.Lock()
+        self._beating = None
+
+    def submit(self, kind, params, uid):
+        job = Job(kind=kind, uid=uid, params=json.dumps(params), heartbeat_at=datetime.now())
+        db.session.add(job)
+        db.session.commit()
+
+        future = self._executor.submit(self._run, job.id)
+        with self._lock:
+            self._futures[job.id] = future
+            if self._beating is None:
+                self._beating = threading.Thread(target=self._beat, name='job-heartbeat', daemon=True)
+                self._beating.start()
+        future.add_done_callback(lambda future, job_id=job.id: self._forget(job_id))
+        return job
+
+    def _beat(self):
+        # runs while there are unfinished jobs, submit starts it again after it stopped
+        while True:
+            time.sleep(self.heartbeat)
+            with self._lock:
+                job_ids = list(self._futures)
+                if not job_ids:
+                    self._beating = None
+                    return
+            try:
+                with self.app.app_context(), db.engine.begin() as connection:
+                    connection.execute(
+                        update(Job).where(Job.id.in_(job_ids), Job.status.in_(('queued', 'running')))
+                        .values(heartbeat_at=datetime.now())
+                    )
+            except Exception:
+                self.app.logger.exception("Could not refresh the heartbeat of running jobs")
+
+    def _forget(self, job_id):
+        with self._lock:
+            self._futures.pop(job_id, None)
+
+    def cancel(self, job):
+        with self._lock:
+            future = self._futures.get(job.id)
+        if future is not None and future.cancel():
+            job.status = 'cancelled'
+            job.finished_at = datetime.now()
+        elif job.status in ('queued', 'running'):
+            job.cancel_requested = True
+        db.session.commit()
+
+    def cancel_requested(self, job_id):
+        # own connection: the job's session may hold a read snapshot older than the flag
+        with db.engine.connect() as connection:
+            return connection.execute(select(Job.cancel_requested).where(Job.id == job_id)).scalar()
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            try:
+                job = db.session.get(Job, job_id)
+                if job is None or job.status != 'queued':
+                    return
+                if job.cancel_requested:
+                    job.status = 'cancelled'
+                    job.finished_at = datetime.now()
+                    db.session.commit()
+                    return
+                job.status = 'running'
+                job.started_at = datetime.now()
+                db.session.commit()
+
+                self._execute(job)
+            finally:
+                db.session.remove()
+
+    def _execute(self, job):
+        kind = JOB_KINDS[job.kind]
+        path = os.path.join(self.directory, f"job-{job.id}.{kind.extension}") if kind.extension else None
+        job_id = job.id
+        interval = self.app.config.get('JOB_CANCEL_CHECK_INTERVAL', 0.1)
+        last_check = 0
+
+        def checkpoint():
+            # jobs may checkpoint in tight loops, the flag is read at most once per interval
+            nonlocal last_check
+            if time.monotonic() - last_check < interval:
+                return
+            last_check = time.monotonic()
+            if self.cancel_requested(job_id):
+                raise JobCancelled()
+
+        try:
+            if path:
+                os.makedirs(self.directory, exist_ok=True)
+            kind.function(json.loads(job.params), path, checkpoint)
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            if isinstance(e, JobCancelled):
+                job.status = 'cancelled'
+            else:
+                self.app.logger.exception(f"Job {job_id} ({job.kind}) failed")
+                job.status = 'failed'
+                job.error = str(e)
+            if path and os.path.exists(path):
+                os.remove(path)
+        else:
+            job = db.session.get(Job, job_id)
+            job.status = 'succeeded'
+            job.result_path = path
+            job.result_mimetype = kind.mimetype
+        job.finished_at = datetime.now()
+        db.session.commit()
+
+def fail_interrupted_jobs():
+    """
+    Marks the jobs that were queued or running when the server stopped as failed.
+    Must only run while no server is running, i.e. at container start.
+    Returns the number of jobs marked.
+    """
+    count = Job.query.filter(Job.status.in_(('queued', 'running'))).update(
+        {'status': 'failed', 'error': 'Interrupted by a server restart', 'finished_at': datetime.now()},
+        synchronize_session=False
+    )
+    db.session.commit()
+    return count
+
+def fail_stale_jobs(lease, *criteria):
+    """
+    Marks queued or running jobs whose runner has not refreshed their heartbeat
+    for lease seconds as failed, e.g. because its worker process was killed.
+    Extra criteria narrow the jobs checked. Returns the number of jobs marked.
+    """
+    # own connection on the primary: job status is read by GET requests on the read-only engine
+    with db.engine.begin() as connection:
+        return connection.execute(
+            update(Job).where(
+                Job.status.in_(('queued', 'running')),
+                Job.heartbeat_at < datetime.now() - timedelta(seconds=lease),
+                *criteria
+            ).values(status='failed', error='The worker running the job stopped', finished_at=datetime.now())
+        ).rowcount
+
+def expire_results(ttl):
+    """
+    Deletes the result files of jobs that finished more than ttl seconds ago
+    and clears their result_path. Returns the number of results deleted.
+    """
+    jobs = Job.query.filter(
+        Job.result_path.isnot(None),
+        Job.finished_at < datetime.now() - timedelta(seconds=ttl)
+    ).all()
+    for job in jobs:
+        if os.path.exists(job.result_path):
+            os.remove(job.result_path)
+        job.result_path = None
+    db.session.commit()
+    return len(jobs)
+
+def init_job_runner(app):
+    runner = JobRunner(
+        app,
+        max_workers=app.config.get('JOB_WORKERS', 2),
+        directory=app.config.get('JOB_DIR') or os.path.join(app.instance_path, 'jobs'),
+        heartbeat=app.config.get('JOB_HEARTBEAT_SECONDS', 10)
+    )
+    app.extensions['jobs'] = runner
+    return runner
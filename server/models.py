@@ -1,5 +1,17 @@
 from app import db
-from datetime import date
+from sqlalchemy.orm import validates
+from datetime import date, datetime
+import unicodedata
+
+TRANSACTION_TYPES = ('borrow', 'return', 'purchase', 'dispose')
+transaction_type_enum = db.Enum(*TRANSACTION_TYPES, name='transaction_types')
+
+def normalize_key(description):
+    """
+    Folds an item description to its lookup key: Unicode NFKC normalized, case-folded,
+    trimmed and with inner runs of whitespace collapsed to one space.
+    """
+    return ' '.join(unicodedata.normalize('NFKC', description).casefold().split())
 
 class User(db.Model):
     """
@@ -25,12 +37,28 @@ class Item(db.Model):
     Represents an item in the inventory database.
     Attributes:
         iid (int): The primary key identifier for the item.
-        description (str): A text description of the item. Cannot be null.
+        description (str): A text description of the item, as it was typed. Cannot be null.
+        key (str): Normalized description (see normalize_key), set with the description.
+            Unique and indexed, every lookup by description goes through it.
+        version (int): Data version of the last write touching the item's stock, used for delta syncs.
+        barcode (str): Optional barcode on the item. Unique and indexed, like box barcodes.
+        available (int): Units in the depot right now (purchased - disposed - borrowed + returned),
+            maintained on every transaction so stock checks do not sum the item's history.
     """
     __tablename__ = 'items'
     
     iid = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.Text, nullable=False)
+    # nullable so the column can be added to existing tables, 'flask normalize-items' backfills it
+    key = db.Column(db.Text, nullable=True, unique=True)
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+    barcode = db.Column(db.Text, nullable=True, unique=True)
+    available = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    @validates('description')
+    def set_key(self, attribute, description):
+        self.key = normalize_key(description) if description is not None else None
+        return description
 
 class Transaction(db.Model):
     """
@@ -43,13 +71,297 @@ class Transaction(db.Model):
         uid (int): Foreign key reference to the user who performed the transaction.
         transaction_type (Enum): Type of transaction - 'borrow', 'return', 'purchase', or 'dispose'.
         quantity (int): Number of items involved in the transaction.
-        date (DateTime): Date and time when the transaction occurred, defaults to current date.
+        date (DateTime): Date and time when the transaction occurred, set on insert.
+            Indexed on its own for date ranges and after iid for the history of an item.
+        compacted (bool): Flag indicating a carry-forward row that folds older transactions of the
+            same item, user, type and location. The original rows are kept in the transaction archive.
+        lid (int): Optional foreign key reference to the location (depot) the transaction happened at.
     """
     __tablename__ = 'transations'
+    __table_args__ = (
+        db.Index('ix_transations_lid_iid', 'lid', 'iid'),
+        db.Index('ix_transations_iid_date', 'iid', 'date'),
+    )
     
     tid = db.Column(db.Integer, primary_key=True)
     iid = db.Column(db.Integer, db.ForeignKey('items.iid'), nullable=False)
     uid = db.Column(db.Integer, db.ForeignKey('users.uid'), nullable=False)
-    transaction_type = db.Column(db.Enum('borrow', 'return', 'purchase', 'dispose', name='transaction_types'), nullable=False)
+    transaction_type = db.Column(transaction_type_enum, nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
-    date = db.Column(db.DateTime, default=date.today())
\ No newline at end of file
+    # evaluated per insert; the server default covers rows written outside the ORM
+    date = db.Column(db.DateTime, default=datetime.now, server_default=db.func.now(), index=True)
+    compacted = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    lid = db.Column(db.Integer, db.ForeignKey('locations.lid'), nullable=True)
+
+class Location(db.Model):
+    """
+    Represents a depot holding its own stock of the shared items.
+    Attributes:
+        lid (int): The primary key identifier for the location.
+        name (str): Unique name of the location. Cannot be null.
+    """
+    __tablename__ = 'locations'
+
+    lid = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.Text, nullable=False, unique=True)
+
+class LocationStock(db.Model):
+    """
+    Represents the running transaction totals of one item at one location.
+    Maintained incrementally on every transaction that names a location. The primary key
+    leads with lid, so the stock of one location is a range read of its own rows, whatever
+    the number of other locations sharing the database.
+    Attributes:
+        lid (int): Foreign key reference to the location, first part of the primary key.
+        iid (int): Foreign key reference to the item, second part of the primary key.
+        borrowed (int): Total quantity borrowed at the location.
+        returned (int): Total quantity returned at the location.
+        purchased (int): Total quantity purchased for the location.
+        disposed (int): Total quantity disposed at the location.
+        available (int): Units at the location right now (purchased - disposed - borrowed + returned).
+    """
+    __tablename__ = 'location_stock'
+
+    lid = db.Column(db.Integer, db.ForeignKey('locations.lid'), primary_key=True)
+    iid = db.Column(db.Integer, db.ForeignKey('items.iid'), primary_key=True)
+    borrowed = db.Column(db.Integer, nullable=False, default=0)
+    returned = db.Column(db.Integer, nullable=False, default=0)
+    purchased = db.Column(db.Integer, nullable=False, default=0)
+    disposed = db.Column(db.Integer, nullable=False, default=0)
+    available = db.Column(db.Integer, nullable=False, default=0)
+
+class StockSnapshot(db.Model):
+    """
+    Represents a checkpoint of the cumulative transaction totals of one item.
+    Snapshots are taken for all items at once, so every row of a checkpoint shares
+    the same taken_at and last_tid. Stock at any later point is the snapshot plus
+    the transactions with a tid above last_tid.
+    Attributes:
+        sid (int): Primary key, unique snapshot row identifier.
+        taken_at (DateTime): Moment the checkpoint was taken.
+        last_tid (int): Highest transaction id included in the checkpoint.
+        iid (int): Foreign key reference to the item the totals belong to.
+        borrowed (int): Total quantity borrowed up to last_tid.
+        returned (int): Total quantity returned up to last_tid.
+        purchased (int): Total quantity purchased up to last_tid.
+        disposed (int): Total quantity disposed up to last_tid.
+    """
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (db.UniqueConstraint('taken_at', 'iid'),)
+
+    sid = db.Column(db.Integer, primary_key=True)
+    taken_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_tid = db.Column(db.Integer, nullable=False)
+    iid = db.Column(db.Integer, db.ForeignKey('items.iid'), nullable=False)
+    borrowed = db.Column(db.Integer, nullable=False, default=0)
+    returned = db.Column(db.Integer, nullable=False, default=0)
+    purchased = db.Column(db.Integer, nullable=False, default=0)
+    disposed = db.Column(db.Integer, nullable=False, default=0)
+
+class LoanBalance(db.Model):
+    """
+    Represents the number of units of an item a user still has on loan.
+    Maintained incrementally on every borrow and return, so outstanding loans are an
+    index lookup instead of a scan of the transaction log.
+    Attributes:
+        uid (int): Foreign key reference to the borrowing user, first part of the primary key.
+        iid (int): Foreign key reference to the borrowed item, second part of the primary key.
+        outstanding (int): Quantity borrowed minus quantity returned.
+    """
+    __tablename__ = 'loan_balances'
+
+    uid = db.Column(db.Integer, db.ForeignKey('users.uid'), primary_key=True)
+    iid = db.Column(db.Integer, db.ForeignKey('items.iid'), primary_key=True)
+    outstanding = db.Column(db.Integer, nullable=False, default=0)
+
+class DailyUsage(db.Model):
+    """
+    Represents the total quantity moved for one item, day and transaction type.
+    Maintained incrementally on every transaction and used by the report endpoints,
+    so reports never aggregate the transaction log itself.
+    Attributes:
+        iid (int): Foreign key reference to the item, part of the primary key.
+        day (Date): Day the transactions happened, part of the primary key.
+        transaction_type (Enum): Type of the transactions, part of the primary key.
+        quantity (int): Summed quantity of the transactions.
+    """
+    __tablename__ = 'daily_usage'
+
+    iid = db.Column(db.Integer, db.ForeignKey('items.iid'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    transaction_type = db.Column(transaction_type_enum, primary_key=True)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+
+class Counter(db.Model):
+    """
+    Represents a named, monotonically increasing counter shared by all workers.
+    Attributes:
+        name (str): Primary key, name of the counter.
+        value (int): Current value of the counter.
+    """
+    __tablename__ = 'counters'
+
+    name = db.Column(db.Text, primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class Box(db.Model):
+    """
+    Represents a physical box in the depot, identified by the barcode printed on it.
+    Attributes:
+        bid (int): The primary key identifier for the box.
+        description (str): A text description of the box. Cannot be null.
+        barcode (str): The barcode on the box. Unique and indexed, since scanning is the busiest lookup.
+        contents (list[Content]): The contents of the box that have not been removed.
+    """
+    __tablename__ = 'boxes'
+
+    bid = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.Text, nullable=False)
+    barcode = db.Column(db.Text, nullable=False, unique=True)
+
+    contents = db.relationship(
+        'Content',
+        primaryjoin='and_(Box.bid == Content.bid, Content.date_deleted.is_(None))',
+        viewonly=True
+    )
+
+class Content(db.Model):
+    """
+    Represents a line on the packing list of a box.
+    Removed contents are soft-deleted by setting date_deleted; a partial index on bid
+    only covers the rows that are still in a box.
+    Attributes:
+        cid (int): Primary key, unique content identifier.
+        bid (int): Foreign key reference to the box holding the content.
+        iid (int): Optional foreign key reference to the inventory item the content is.
+        description (str): Lowercased description of the content. Cannot be null.
+        quantity (int): Number of units in the box.
+        date_added (Date): Date the content was added, defaults to the current date.
+        date_deleted (Date): Date the content was removed from the box, null while it is in the box.
+        item (Item): The inventory item, loaded in the same query as the content.
+    """
+    __tablename__ = 'contents'
+    __table_args__ = (
+        db.Index(
+            'ix_contents_active_bid', 'bid',
+            sqlite_where=db.text('date_deleted IS NULL'),
+            postgresql_where=db.text('date_deleted IS NULL')
+        ),
+    )
+
+    cid = db.Column(db.Integer, primary_key=True)
+    bid = db.Column(db.Integer, db.ForeignKey('boxes.bid'), nullable=False)
+    iid = db.Column(db.Integer, db.ForeignKey('items.iid'), nullable=True)
+    description = db.Column(db.Text, nullable=False)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    date_added = db.Column(db.Date, default=date.today)
+    date_deleted = db.Column(db.Date, nullable=True)
+
+    item = db.relationship('Item', lazy='joined')
+
+    def serialize(self):
+        return {
+            'id': self.cid,
+            'bid': self.bid,
+            'iid': self.iid,
+            'description': self.description,
+            'quantity': self.quantity,
+            'item': self.item.description if self.item else None,
+        }
+
+class ItemUse(db.Model):
+    """
+    Represents a loan of an item for a period, ended by setting end_date.
+    Attributes:
+        id (int): Primary key, unique loan identifier.
+        iid (int): Foreign key reference to the loaned item.
+        uid (int): Optional foreign key reference to the user who took the loan.
+        quantity (int): Number of units loaned.
+        start_date (DateTime): Start of the loan, defaults to the current date and time.
+        end_date (DateTime): End of the loan, null while the loan is running.
+    """
+    __tablename__ = 'item_uses'
+
+    id = db.Column(db.Integer, primary_key=True)
+    iid = db.Column(db.Integer, db.ForeignKey('items.iid'), nullable=False)
+    uid = db.Column(db.Integer, db.ForeignKey('users.uid'), nullable=True)
+    quantity = db.Column(db.Integer, nullable=False, default=1)
+    start_date = db.Column(db.DateTime, default=datetime.now)
+    end_date = db.Column(db.DateTime, nullable=True)
+
+class IdempotencyKey(db.Model):
+    """
+    Represents a write request made with an Idempotency-Key header and the response it got.
+    Shared by all workers, so a retry landing on another worker is replayed too.
+    Attributes:
+        uid (int): The user who sent the request, first part of the primary key.
+        key (str): The Idempotency-Key header value, second part of the primary key.
+        method (str): HTTP method of the original request.
+        path (str): Path of the original request.
+        request_hash (str): SHA-256 of the original request body.
+        status_code (int): Status code of the response, null while the request is in progress.
+        body (str): Body of the response.
+        mimetype (str): Media type of the response.
+        headers (str): JSON encoded response headers that are replayed, e.g. Location.
+        created_at (DateTime): Moment the key was claimed, used for TTL eviction and the in-progress lease.
+    """
+    __tablename__ = 'idempotency_keys'
+
+    uid = db.Column(db.Integer, db.ForeignKey('users.uid'), primary_key=True)
+    key = db.Column(db.Text, primary_key=True)
+    method = db.Column(db.Text, nullable=False)
+    path = db.Column(db.Text, nullable=False)
+    request_hash = db.Column(db.Text, nullable=True)
+    status_code = db.Column(db.Integer, nullable=True)
+    body = db.Column(db.Text, nullable=True)
+    mimetype = db.Column(db.Text, nullable=True)
+    headers = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+JOB_STATUSES = ('queued', 'running', 'succeeded', 'failed', 'cancelled')
+
+class Job(db.Model):
+    """
+    Represents a long-running operation run by the background job runner.
+    Attributes:
+        id (int): Primary key, unique job identifier.
+        kind (str): Name of the job function, e.g. 'export_transactions'.
+        uid (int): Foreign key reference to the user who submitted the job.
+        params (str): JSON encoded parameters of the job.
+        status (Enum): 'queued', 'running', 'succeeded', 'failed' or 'cancelled'.
+        cancel_requested (bool): Set to ask a running job to stop at its next checkpoint.
+        result_path (str): File holding the result of a succeeded job.
+        result_mimetype (str): Media type of the result file.
+        error (str): Error message of a failed job.
+        created_at (DateTime): Moment the job was submitted.
+        started_at (DateTime): Moment a worker thread picked the job up.
+        finished_at (DateTime): Moment the job succeeded, failed or was cancelled.
+        heartbeat_at (DateTime): Last moment the runner owning an unfinished job was known to be alive.
+    """
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.Text, nullable=False)
+    uid = db.Column(db.Integer, db.ForeignKey('users.uid'), nullable=False, index=True)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    status = db.Column(db.Enum(*JOB_STATUSES, name='job_statuses'), nullable=False, default='queued', index=True)
+    cancel_requested = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    result_path = db.Column(db.Text, nullable=True)
+    result_mimetype = db.Column(db.Text, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+    def serialize(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'cancel_requested': self.cancel_requested,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
@@ -0,0 +1,89 @@
+from app import db
+from models import User
+from flask import request, session, current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from collections import namedtuple
+from functools import wraps
+import threading
+import time
+
+# permission name to the User column granting it
+PERMISSIONS = {
+    'edit': 'edit_permission',
+}
+
+UserClaims = namedtuple('UserClaims', ['uid', 'username', 'edit_permission'])
+
+class UserCache:
+    """
+    Short-lived per-worker cache of the permission claims of users, so permission checks
+    do not query the users table on every request. Changes made by this worker are seen
+    right after their commit, changes made by other workers within the TTL.
+    """
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._claims = {}
+        self._lock = threading.Lock()
+
+    def get(self, uid):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._claims.get(uid)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+
+        user = db.session.get(User, uid)
+        claims = UserClaims(user.uid, user.username, bool(user.edit_permission)) if user else None
+        ttl = current_app.config.get('USER_CACHE_TTL_SECONDS', self.ttl)
+        with self._lock:
+            self._claims[uid] = (now + ttl, claims)
+        return claims
+
+    def invalidate(self, uid):
+        with self._lock:
+            self._claims.pop(uid, None)
+
+    def clear(self):
+        with self._lock:
+            self._claims.clear()
+
+users = UserCache()
+
+def has_permission(uid, permission):
+    claims = users.get(uid)
+    return bool(claims and getattr(claims, PERMISSIONS[permission]))
+
+def permission_required(permission):
+    """
+    Requires a logged in user holding the permission. Answers 401 without a session
+    and 403 without the permission.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if 'user_id' not in session:
+                current_app.logger.info(f"Unauthorized login request - request from {request.remote_addr}")
+                return {'error': 'Authentication required'}, 401
+            if not has_permission(session['user_id'], permission):
+                current_app.logger.info(f"Forbidden {permission} request by user {session['user_id']} - request from {request.remote_addr}")
+                return {'error': f'{permission.capitalize()} permission required'}, 403
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+@event.listens_for(Session, 'after_flush')
+def queue_user_changes(session, flush_context):
+    # new users too: a uid may have been cached as unknown before
+    changed = [obj.uid for obj in (*session.new, *session.dirty, *session.deleted) if isinstance(obj, User)]
+    if changed:
+        session.info.setdefault('changed_users', set()).update(changed)
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed_users(session):
+    for uid in session.info.pop('changed_users', ()):
+        users.invalidate(uid)
+
+@event.listens_for(Session, 'after_soft_rollback')
+def drop_user_changes(session, previous_transaction):
+    session.info.pop('changed_users', None)
@@ -0,0 +1,116 @@
+from permissions import has_permission
+from flask import request, session, g
+from collections import Counter
+from datetime import datetime
+import cProfile
+import os
+import sys
+import threading
+
+# only one profiler can be attached to the interpreter at a time
+profiler_lock = threading.Lock()
+
+class StackSampler:
+    """
+    Samples the stack of one thread at a fixed interval and counts identical stacks.
+    The counts are written in the folded format read by flamegraph.pl and speedscope.
+    """
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.stacks = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def enable(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def dump_stats(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+PROFILERS = {
+    'cprofile': ('prof', cProfile.Profile),
+    'sample': ('folded', StackSampler),
+}
+
+def profiling_requested():
+    return request.headers.get('X-Profile') == '1' or request.args.get('profile') == '1'
+
+def register_profiling(app):
+    """
+    Profiles single requests on demand. A request is profiled when it carries an
+    X-Profile: 1 header or a profile=1 query parameter and comes from a user with
+    edit permission; every other request only pays for the flag check.
+    """
+    kind = app.config.get('PROFILER', 'cprofile')
+    if kind not in PROFILERS:
+        raise ValueError(f"Unknown PROFILER {kind}, valid profilers are: {', '.join(PROFILERS)}")
+    extension, profiler_class = PROFILERS[kind]
+
+    @app.before_request
+    def start_profiler():
+        if not profiling_requested() or 'user_id' not in session:
+            return
+        if not has_permission(session['user_id'], 'edit'):
+            return
+        if not profiler_lock.acquire(blocking=False):
+            g.profile_busy = True
+            return
+
+        if kind == 'sample':
+            profiler = profiler_class(app.config.get('PROFILE_SAMPLE_INTERVAL_MS', 1) / 1000)
+        else:
+            profiler = profiler_class()
+        try:
+            profiler.enable()
+        except Exception:
+            profiler_lock.release()
+            raise
+        g.profiler = profiler
+
+    @app.after_request
+    def stop_profiler(response):
+        if g.pop('profile_busy', False):
+            response.headers['X-Profile'] = 'busy'
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+
+        try:
+            profiler.disable()
+            directory = app.config.get('PROFILE_DIR') or os.path.join(app.instance_path, 'profiles')
+            os.makedirs(directory, exist_ok=True)
+            name = f"{request.endpoint}-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}.{extension}"
+            profiler.dump_stats(os.path.join(directory, name))
+        finally:
+            profiler_lock.release()
+
+        app.logger.info(f"Profiled {request.method} {request.path} into {name}")
+        response.headers['X-Profile'] = name
+        return response
+
+    @app.teardown_request
+    def release_profiler(exception):
+        # after_request is skipped when the view raised
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            profiler_lock.release()
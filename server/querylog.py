@@ -0,0 +1,133 @@
+from flask import request, has_request_context
+from sqlalchemy import event
+import re
+import threading
+import time
+
+# literals and expanded IN lists are folded, so one query shape gets one fingerprint
+FINGERPRINT_PATTERNS = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%\(\w+\)s|%s|:\w+|\$\d+'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?+)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+def fingerprint(statement):
+    for pattern, replacement in FINGERPRINT_PATTERNS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+def parameter_shape(parameters, executemany=False):
+    """
+    Describes the bound parameters by type only, so logs never contain user data.
+    """
+    if executemany:
+        return f"{len(parameters)} x {parameter_shape(parameters[0]) if parameters else '()'}"
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in parameters or ()) + ')'
+
+class SlowQueryStats:
+    """
+    Per-worker totals of the slow statements, aggregated by fingerprint.
+    """
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, statement, elapsed, route):
+        key = fingerprint(statement)
+        with self._lock:
+            stats = self._stats.setdefault(key, {'fingerprint': key, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'routes': set()})
+            stats['count'] += 1
+            stats['total_ms'] += elapsed * 1000
+            stats['max_ms'] = max(stats['max_ms'], elapsed * 1000)
+            stats['routes'].add(route)
+
+    def top(self, limit=20):
+        """
+        Returns the fingerprints that cost the most time in total, most expensive first.
+        """
+        with self._lock:
+            rows = sorted(self._stats.values(), key=lambda stats: stats['total_ms'], reverse=True)[:limit]
+            return [{**stats, 'routes': sorted(stats['routes'])} for stats in rows]
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+slow_queries = SlowQueryStats()
+
+def format_plan(rows):
+    return '\n'.join(' '.join(str(column) for column in row) for row in rows)
+
+def explain(connection, statement, parameters):
+    """
+    Returns the query plan of a statement that just ran on connection, inside the
+    caller's transaction. Raises when the plan cannot be produced.
+    """
+    # a separate cursor, the statement's own cursor still holds its results
+    cursor = connection.connection.cursor()
+    try:
+        if connection.dialect.name == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            return format_plan(cursor.fetchall())
+
+        # any failed statement aborts the whole transaction on PostgreSQL, fail inside a savepoint instead
+        cursor.execute('SAVEPOINT explain_plan')
+        try:
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            return format_plan(cursor.fetchall())
+        except Exception:
+            cursor.execute('ROLLBACK TO SAVEPOINT explain_plan')
+            raise
+        finally:
+            cursor.execute('RELEASE SAVEPOINT explain_plan')
+    finally:
+        cursor.close()
+
+def register_query_log(app, db):
+    """
+    Times every statement of every engine. Statements slower than SLOW_QUERY_MS are logged
+    with their parameter shape, the route that ran them and their query plan, and counted
+    in slow_queries.
+    """
+    threshold = app.config.get('SLOW_QUERY_MS', 100) / 1000
+    with_plan = app.config.get('SLOW_QUERY_EXPLAIN', True)
+
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault('query_start', []).append(time.perf_counter())
+
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - connection.info['query_start'].pop()
+        if elapsed < threshold:
+            return
+
+        route = request.endpoint if has_request_context() else 'cli'
+        slow_queries.add(statement, elapsed, route)
+
+        plan = None
+        if with_plan and not executemany and statement.split(None, 1)[0].upper() in EXPLAINABLE:
+            try:
+                plan = explain(connection, statement, parameters)
+            except Exception as e:
+                plan = f"unavailable: {e}"
+
+        app.logger.warning(
+            f"Slow query ({elapsed * 1000:.1f} ms) in {route}: {' '.join(statement.split())} "
+            f"params={parameter_shape(parameters, executemany)}" + (f"\nplan:\n{plan}" if plan else '')
+        )
+
+    def handle_error(context):
+        # failed statements never reach after_cursor_execute
+        if context.connection is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+            event.listen(engine, 'handle_error', handle_error)
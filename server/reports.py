@@ -0,0 +1,60 @@
+from app import db
+from models import Item, DailyUsage
+from sqlalchemy import func
+
+# strftime formats (SQLite) and to_char formats (PostgreSQL) per report period
+PERIOD_FORMATS = {
+    'day': ('%Y-%m-%d', 'YYYY-MM-DD'),
+    'month': ('%Y-%m', 'YYYY-MM'),
+    'year': ('%Y', 'YYYY'),
+    'month_of_year': ('%m', 'MM'),
+}
+
+def period_expression(period):
+    sqlite_format, postgresql_format = PERIOD_FORMATS[period]
+    if db.session.get_bind().dialect.name == 'postgresql':
+        return func.to_char(DailyUsage.day, postgresql_format)
+    return func.strftime(sqlite_format, DailyUsage.day)
+
+def filter_usage(query, start=None, end=None, transaction_type=None, iid=None):
+    if start is not None:
+        query = query.filter(DailyUsage.day >= start)
+    if end is not None:
+        query = query.filter(DailyUsage.day <= end)
+    if transaction_type is not None:
+        query = query.filter(DailyUsage.transaction_type == transaction_type)
+    if iid is not None:
+        query = query.filter(DailyUsage.iid == iid)
+    return query
+
+def usage_report(period='month', **filters):
+    """
+    Returns the quantity per period, item and transaction type from the daily rollups.
+    """
+    period_column = period_expression(period)
+    query = db.session.query(
+        period_column,
+        Item.description,
+        DailyUsage.transaction_type,
+        func.sum(DailyUsage.quantity)
+    ).join(Item, Item.iid == DailyUsage.iid)
+    query = filter_usage(query, **filters) \
+        .group_by(period_column, Item.description, DailyUsage.transaction_type) \
+        .order_by(period_column, Item.description)
+
+    return [{
+        'period': period_value,
+        'description': description,
+        'transaction_type': transaction_type,
+        'quantity': quantity,
+    } for period_value, description, transaction_type, quantity in query]
+
+def peak_report(**filters):
+    """
+    Returns the quantity per calendar month summed over all years, busiest month first.
+    """
+    month = period_expression('month_of_year')
+    query = db.session.query(month, func.sum(DailyUsage.quantity))
+    query = filter_usage(query, **filters).group_by(month).order_by(func.sum(DailyUsage.quantity).desc())
+
+    return [{'month': int(month_value), 'quantity': quantity} for month_value, quantity in query]
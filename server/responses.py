@@ -0,0 +1,89 @@
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+import gzip
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/javascript',
+    'text/html',
+    'text/css',
+    'text/plain',
+    'image/svg+xml',
+}
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON provider backed by orjson. Used instead of the stdlib provider when orjson is installed,
+    and produces the same values: dates and dataclasses go through the stdlib provider's default
+    (HTTP dates, not ISO), and whatever orjson cannot encode, like integers beyond 64 bits,
+    is encoded by the stdlib provider.
+    """
+    def _options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def _encode(self, obj):
+        try:
+            return orjson.dumps(obj, default=self.default, option=self._options())
+        except orjson.JSONEncodeError:
+            return super().dumps(obj).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        return self._encode(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._encode(obj), mimetype=self.mimetype)
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        # brotli qualities go up to 11, keep the same relative effort as gzip
+        return brotli.compress(data, quality=min(11, level))
+    return gzip.compress(data, compresslevel=level)
+
+def choose_encoding():
+    if brotli and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+def register_responses(app):
+    if orjson:
+        app.json = OrjsonProvider(app)
+    app.logger.info(f"Using JSON provider {type(app.json).__name__}")
+
+    @app.after_request
+    def compress_response(response):
+        # streamed responses (event stream) and files sent by send_from_directory are left alone
+        if response.direct_passthrough or response.is_streamed:
+            return response
+        if response.mimetype not in COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        if response.content_length is not None and response.content_length < app.config.get('COMPRESS_MIN_SIZE', 1024):
+            return response
+
+        encoding = choose_encoding()
+        if not encoding:
+            return response
+
+        response.set_data(compress(response.get_data(), encoding, app.config.get('COMPRESS_LEVEL', 6)))
+        response.headers['Content-Encoding'] = encoding
+        return response
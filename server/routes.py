@@ -1,12 +1,27 @@
-from flask import request, session, jsonify
-from datetime import date
-from models import Item, Transaction, User
+from flask import request, session, jsonify, Response
+from datetime import date, datetime
+from models import Item, Transaction, User, LoanBalance, Box, Content, Location, Job, TRANSACTION_TYPES, normalize_key
+from stock import stock_totals, location_totals, parse_as_of, empty_totals, record_transaction, next_version, current_version, InsufficientStock, NothingOnLoan
+from reports import usage_report, peak_report
+from events import feed, queue_event
+from barcodes import barcode_map
+from idempotency import idempotent
+from querylog import slow_queries
+from jobs import JOB_KINDS, fail_stale_jobs, expire_results
+from permissions import permission_required, has_permission
+from sessions import mark_read_only
+from sqlalchemy.orm import joinedload
+from sqlalchemy import select, func
+import json
 from flask_cors import cross_origin
-from flask import send_from_directory
+from flask import send_from_directory, send_file
 from functools import wraps
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from sqlalchemy.exc import SQLAlchemyError
 import os
 
+COLUMNAR_MIMETYPE = 'application/vnd.kazou.columnar+json'
+
 def register_routes(app, db, bcrypt):
     def login_required(f):
         @wraps(f)
@@ -16,6 +31,8 @@ def register_routes(app, db, bcrypt):
                 return {'error': 'Authentication required'}, 401
             return f(*args, **kwargs)
         return decorated_function
+
+    admin_required = permission_required('edit')
     
     @app.errorhandler(SQLAlchemyError)
     def handle_sqlalchemy_error(e):
@@ -103,18 +120,26 @@ def register_routes(app, db, bcrypt):
     @app.route('/api/add_item', methods=['POST'])
     @cross_origin(supports_credentials=True)
     @login_required
+    @idempotent
     def add_item():
         data = request.get_json()
 
         description = data['description']
+        barcode = data.get('barcode') or None
 
         if not description:
             return {'error': 'no description provided'}, 400
-        elif Item.query.filter_by(description=description).first():
+        elif Item.query.filter_by(key=normalize_key(description)).first():
             return {'error': 'Item already exists'}, 400
+        elif barcode and barcode_map.resolve([barcode]):
+            return {'error': 'Barcode already in use'}, 400
 
-        item = Item(description=description)
+        item = Item(description=description, barcode=barcode, version=next_version())
+        if barcode:
+            next_version('barcodes')
         db.session.add(item)
+        db.session.flush()
+        queue_event({'event': 'item_added', 'iid': item.iid, 'description': item.description, 'quantity': 0, 'loaned': 0})
         db.session.commit()
 
         loggermessage = f'Added new item - {description}'
@@ -126,8 +151,9 @@ def register_routes(app, db, bcrypt):
     @app.route('/api/transaction/<transaction_type>', methods=['POST'])
     @cross_origin(supports_credentials=True)
     @login_required
+    @idempotent
     def add_transaction(transaction_type):
-        if not transaction_type in ['borrow', 'return', 'purchase', 'dispose']:
+        if not transaction_type in TRANSACTION_TYPES:
             return {'error', 'Invalid transaction type. Valid types are: borrow, return, purchase, dispose'}, 400
 
         data = request.get_json()
@@ -138,14 +164,55 @@ def register_routes(app, db, bcrypt):
         if not item_description or not quantity:
             return {"error": "Description and quantity are required"}, 400
 
-        item = Item.query.filter_by(description=item_description.lower()).first()
+        try:
+            quantity = int(quantity)
+        except (TypeError, ValueError):
+            return {"error": "Quantity must be a whole number"}, 400
+        if quantity <= 0:
+            return {"error": "Quantity must be positive"}, 400
+
+        item = Item.query.filter_by(key=normalize_key(item_description)).first()
 
         if not item:
             return {"error", "No such item found"}, 400
 
-        transaction = Transaction(iid=item.iid, uid=session['user_id'], transaction_type=transaction_type, quantity=quantity)
-        db.session.add(transaction)
-        db.session.commit()
+        lid = None
+        if data.get('location'):
+            lid = db.session.query(Location.lid).filter_by(name=data['location']).scalar()
+            if lid is None:
+                return {'error': 'No such location'}, 400
+
+        writer = app.extensions.get('group_commit')
+        if writer:
+            future = writer.submit(iid=item.iid, uid=session['user_id'], transaction_type=transaction_type, quantity=quantity, lid=lid)
+            # release this request's read transaction, the writer commits on its own session
+            db.session.rollback()
+            try:
+                try:
+                    future.result(timeout=app.config.get('GROUP_COMMIT_TIMEOUT', 10))
+                except FutureTimeoutError:
+                    # a 503 lets the client retry, which is only safe if the row is never written
+                    if future.cancel():
+                        app.logger.error(f"Group commit timed out for {transaction_type} of {item_description}")
+                        return {'error': 'Transaction could not be committed in time'}, 503
+                    # the writer already took the row, its outcome is the answer
+                    future.result()
+            except NothingOnLoan:
+                return {'error': f'Not enough {item_description} on loan to return'}, 409
+            except InsufficientStock:
+                return {'error': f'Not enough {item_description} in stock'}, 409
+        else:
+            transaction = Transaction(iid=item.iid, uid=session['user_id'], transaction_type=transaction_type, quantity=quantity, lid=lid)
+            db.session.add(transaction)
+            try:
+                record_transaction(transaction)
+            except NothingOnLoan:
+                db.session.rollback()
+                return {'error': f'Not enough {item_description} on loan to return'}, 409
+            except InsufficientStock:
+                db.session.rollback()
+                return {'error': f'Not enough {item_description} in stock'}, 409
+            db.session.commit()
 
         return {'message': 'transaction added succesfully'}, 200
 
@@ -153,22 +220,40 @@ def register_routes(app, db, bcrypt):
     @cross_origin(supports_credentials=True)
     @login_required
     def get_inventory():
-        items = Item.query.all()
+        as_of = request.args.get('as_of')
+        if as_of:
+            try:
+                as_of = parse_as_of(as_of)
+            except ValueError:
+                return {'error': 'Invalid as_of date, expected YYYY-MM-DD or an ISO datetime'}, 400
+        else:
+            as_of = None
+
+        location = request.args.get('location')
+        if location:
+            if as_of:
+                return {'error': 'as_of cannot be combined with location'}, 400
+            lid = db.session.query(Location.lid).filter_by(name=location).scalar()
+            if lid is None:
+                return {'error': 'No such location'}, 404
+            totals = location_totals(lid)
+        else:
+            totals = stock_totals(as_of)
+
+        # plain rows: nothing here is modified, so identity map and change tracking are overhead
+        items = db.session.execute(select(Item.iid, Item.description)).all()
 
         inventory = []
         for item in items:
-            loans = Transaction.query.filter_by(transaction_type='borrow', iid=item.iid).all()
-            returns = Transaction.query.filter_by(transaction_type='return', iid=item.iid).all()
-            purchases = Transaction.query.filter_by(transaction_type='purchase', iid=item.iid).all()
-            disposes = Transaction.query.filter_by(transaction_type='dispose', iid=item.iid).all()
+            item_totals = totals.get(item.iid, empty_totals())
 
-            loaned = sum(loan.quantity for loan in loans)
-            returned = sum(Return.quantity for Return in returns)
-            purchased = sum(purchase.quantity for purchase in purchases)
-            disposed = sum(disposed.quantity for disposed in disposes)
+            loaned = item_totals['borrow']
+            purchased = item_totals['purchase']
+            disposed = item_totals['dispose']
 
             quantity = purchased - disposed
             inventory.append({
+                "iid": item.iid,
                 "description": item.description,
                 "quantity": quantity,
                 "loaned": loaned
@@ -176,18 +261,81 @@ def register_routes(app, db, bcrypt):
 
         inventory.sort(key=lambda x: x["description"].lower())
 
-        return {"inventory": inventory, "count": len(inventory)}, 200
+        if wants_columnar():
+            return columnar_inventory(inventory), 200, {'Vary': 'Accept'}
+
+        for row in inventory:
+            del row["iid"]
+
+        return {"inventory": inventory, "count": len(inventory)}, 200, {'Vary': 'Accept'}
+
+    @app.route('/api/locations', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def get_locations():
+        locations = [{'lid': location.lid, 'name': location.name} for location in Location.query.order_by(Location.name)]
+
+        return {'locations': locations, 'count': len(locations)}, 200
+
+    @app.route('/api/add_location', methods=['POST'])
+    @cross_origin(supports_credentials=True)
+    @admin_required
+    @idempotent
+    def add_location():
+        name = (request.get_json() or {}).get('name')
+
+        if not name:
+            return {'error': 'Name is required'}, 400
+        elif Location.query.filter_by(name=name).first():
+            return {'error': 'Location already exists'}, 400
+
+        location = Location(name=name)
+        db.session.add(location)
+        db.session.commit()
+
+        app.logger.info(f'Added new location - {name}')
+
+        return {'message': 'Location added successfully', 'lid': location.lid}, 201
+
+    def wants_columnar():
+        if request.args.get('format') == 'columnar':
+            return True
+        return request.accept_mimetypes.best_match(['application/json', COLUMNAR_MIMETYPE]) == COLUMNAR_MIMETYPE
+
+    def columnar_inventory(inventory):
+        """
+        Sends the inventory as parallel arrays per field instead of repeating the keys for every item.
+        With ?descriptions=ids the descriptions are left out and clients map the iid column
+        onto the descriptions they already have.
+        """
+        fields = ["iid", "quantity", "loaned"]
+        if request.args.get('descriptions') != 'ids':
+            fields.insert(1, "description")
+
+        columns = {field: [row[field] for row in inventory] for field in fields}
+
+        return {"format": "columnar", "fields": fields, "columns": columns, "count": len(inventory)}
 
     @app.route('/api/item/<item_description>', methods=['GET'])
     @cross_origin(supports_credentials=True)
     @login_required
     def get_item(item_description):
-        item = Item.query.filter_by(description=item_description).first()
+        iid = db.session.execute(select(Item.iid).where(Item.key == normalize_key(item_description))).scalar()
 
-        if not item:
+        if iid is None:
             return {'error': 'No such item'}, 400
 
-        transactions = Transaction.query.filter_by(iid=item.iid).all()
+        # both bounds and the order are served by the (iid, date) index
+        transactions = select(Transaction.tid, Transaction.transaction_type, Transaction.quantity, Transaction.date) \
+            .where(Transaction.iid == iid)
+        try:
+            if request.args.get('from'):
+                transactions = transactions.where(Transaction.date >= datetime.fromisoformat(request.args['from']))
+            if request.args.get('to'):
+                transactions = transactions.where(Transaction.date <= parse_as_of(request.args['to']))
+        except ValueError:
+            return {'error': 'Invalid date, expected YYYY-MM-DD or an ISO datetime'}, 400
+        transactions = db.session.execute(transactions.order_by(Transaction.date, Transaction.tid))
 
         transaction_list = []
         for transaction in transactions:
@@ -195,7 +343,472 @@ def register_routes(app, db, bcrypt):
                 'id': transaction.tid,
                 'transaction_type': transaction.transaction_type,
                 'quantity': transaction.quantity,
-                'date': transaction.date,
+                'date': transaction.date.isoformat() if transaction.date else None,
             })
 
         return {'transaction_list': transaction_list}, 200
+
+    @app.route('/api/items', methods=['POST'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def get_items():
+        """
+        Reads several items ({"descriptions": [...]} or {"ids": [...]}) with their stock and their
+        most recent transactions, in a fixed number of queries per batch. Items are keyed by the
+        description or id they were asked for; unknown ones are listed under "missing".
+        """
+        data = request.get_json() or {}
+
+        by_id = 'ids' in data
+        keys = data.get('ids') if by_id else data.get('descriptions')
+        key_type = int if by_id else str
+        # bool is a subclass of int, but true is not an item id
+        if not keys or not isinstance(keys, list) or \
+                not all(isinstance(key, key_type) and not isinstance(key, bool) and key for key in keys):
+            return {'error': 'A list of descriptions or ids is required'}, 400
+        if len(keys) > app.config.get('ITEM_BATCH_LIMIT', 200):
+            return {'error': 'Too many items in one request'}, 400
+
+        # a POST only to fit long lists in the body, it reads like a GET and uses the read-only engine
+        mark_read_only(db)
+
+        recent = request.args.get('recent', 10, type=int)
+        recent = max(0, min(recent, app.config.get('ITEM_RECENT_LIMIT', 100)))
+
+        items = select(Item.iid, Item.key, Item.description, Item.available)
+        if by_id:
+            items = db.session.execute(items.where(Item.iid.in_(set(keys)))).all()
+        else:
+            items = db.session.execute(items.where(Item.key.in_({normalize_key(key) for key in keys}))).all()
+        iids = [item.iid for item in items]
+        totals = stock_totals(iids=iids) if iids else {}
+
+        transactions = {iid: [] for iid in iids}
+        if iids and recent:
+            # one windowed query for the latest transactions of every item, on the (iid, date) index
+            rank = func.row_number().over(
+                partition_by=Transaction.iid,
+                order_by=(Transaction.date.desc(), Transaction.tid.desc())
+            ).label('rank')
+            ranked = select(
+                Transaction.tid, Transaction.iid, Transaction.transaction_type, Transaction.quantity, Transaction.date, rank
+            ).where(Transaction.iid.in_(iids)).subquery()
+            rows = db.session.execute(select(ranked).where(ranked.c.rank <= recent).order_by(ranked.c.iid, ranked.c.rank))
+            for row in rows:
+                transactions[row.iid].append({
+                    'id': row.tid,
+                    'transaction_type': row.transaction_type,
+                    'quantity': row.quantity,
+                    'date': row.date.isoformat() if row.date else None,
+                })
+
+        serialized = {}
+        for item in items:
+            item_totals = totals.get(item.iid, empty_totals())
+            serialized[item.iid if by_id else item.key] = {
+                'iid': item.iid,
+                'description': item.description,
+                'quantity': item_totals['purchase'] - item_totals['dispose'],
+                'loaned': item_totals['borrow'],
+                'available': item.available,
+                'transaction_list': transactions[item.iid],
+            }
+
+        # keyed as asked for, so differently typed spellings of one item each get their answer
+        found, missing = {}, []
+        for key in keys:
+            entry = serialized.get(key if by_id else normalize_key(key))
+            if entry is None:
+                missing.append(key)
+            else:
+                found[str(key)] = entry
+
+        return {'items': found, 'count': len(found), 'missing': missing}, 200
+
+    def serialize_loans(rows):
+        return [{
+            'uid': balance.uid,
+            'username': username,
+            'iid': balance.iid,
+            'description': description,
+            'outstanding': balance.outstanding,
+        } for balance, description, username in rows]
+
+    def loans_query():
+        return db.session.query(LoanBalance, Item.description, User.username) \
+            .join(Item, Item.iid == LoanBalance.iid) \
+            .join(User, User.uid == LoanBalance.uid) \
+            .filter(LoanBalance.outstanding > 0)
+
+    @app.route('/api/me/loans', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def get_my_loans():
+        loans = serialize_loans(loans_query().filter(LoanBalance.uid == session['user_id']).all())
+
+        return {'loans': loans, 'count': len(loans)}, 200
+
+    @app.route('/api/loans', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @admin_required
+    def get_all_loans():
+        loans = serialize_loans(loans_query().order_by(LoanBalance.uid).all())
+
+        return {'loans': loans, 'count': len(loans)}, 200
+
+    @app.route('/api/admin/slow_queries', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @admin_required
+    def get_slow_queries():
+        queries = slow_queries.top(request.args.get('limit', 20, type=int))
+
+        return {'queries': queries, 'count': len(queries)}, 200
+
+    def report_filters():
+        """Reads the shared report filters from the query string. Raises ValueError on bad input."""
+        filters = {}
+        if request.args.get('from'):
+            filters['start'] = date.fromisoformat(request.args['from'])
+        if request.args.get('to'):
+            filters['end'] = date.fromisoformat(request.args['to'])
+
+        transaction_type = request.args.get('type')
+        if transaction_type:
+            if transaction_type not in TRANSACTION_TYPES:
+                raise ValueError('Invalid transaction type')
+            filters['transaction_type'] = transaction_type
+
+        item_description = request.args.get('item')
+        if item_description:
+            item = Item.query.filter_by(key=normalize_key(item_description)).first()
+            if not item:
+                raise ValueError('No such item')
+            filters['iid'] = item.iid
+
+        return filters
+
+    @app.route('/api/reports/usage', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def get_usage_report():
+        period = request.args.get('period', 'month')
+        if period not in ('day', 'month', 'year'):
+            return {'error': 'Invalid period. Valid periods are: day, month, year'}, 400
+
+        try:
+            filters = report_filters()
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        usage = usage_report(period, **filters)
+
+        return {'usage': usage, 'count': len(usage)}, 200
+
+    @app.route('/api/reports/peak', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def get_peak_report():
+        try:
+            filters = report_filters()
+        except ValueError as e:
+            return {'error': str(e)}, 400
+
+        filters.setdefault('transaction_type', 'borrow')
+
+        return {'months': peak_report(**filters)}, 200
+
+    @app.route('/api/inventory/events', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def inventory_events():
+        """
+        Server-sent events stream of per-item stock deltas. Clients resume with the
+        Last-Event-ID header; a 'reset' event tells them to reload /api/get_inventory.
+        """
+        retry = app.config.get('EVENTS_RETRY_MS', 3000)
+        # every stream holds a server thread, leave enough of them for the rest of the API
+        if not feed.subscribe(app.config.get('EVENTS_MAX_SUBSCRIBERS', 48)):
+            app.logger.warning(f"Event stream refused, subscriber limit reached - request from {request.remote_addr}")
+            return Response(f"retry: {retry}\n\n", status=503, mimetype='text/event-stream', headers={
+                'Retry-After': str(max(1, retry // 1000)),
+            })
+
+        resume_id = request.headers.get('Last-Event-ID')
+        last_id = feed.parse_event_id(resume_id)
+        heartbeat = app.config.get('EVENTS_HEARTBEAT_SECONDS', 15)
+
+        def stream(last_id):
+            yield f"retry: {retry}\n\n"
+            if last_id is None:
+                last_id = feed.sequence
+                if resume_id:
+                    # the id is from another process or from before a restart, the client has to reload
+                    yield f"id: {feed.event_id(last_id)}\nevent: reset\ndata: {{}}\n\n"
+            while True:
+                events = feed.wait(last_id, timeout=heartbeat)
+                if events is None:
+                    last_id = feed.sequence
+                    yield f"id: {feed.event_id(last_id)}\nevent: reset\ndata: {{}}\n\n"
+                elif not events:
+                    yield ": keep-alive\n\n"
+                for sequence, change in events or []:
+                    last_id = sequence
+                    yield f"id: {feed.event_id(sequence)}\nevent: {change['event']}\ndata: {json.dumps(change)}\n\n"
+
+        response = Response(stream(last_id), mimetype='text/event-stream', headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',
+        })
+        # also runs when the client leaves before the stream started, unlike a finally in stream
+        response.call_on_close(feed.unsubscribe)
+        return response
+
+    @app.route('/api/inventory/changes', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def get_inventory_changes():
+        since = request.args.get('since', 0, type=int)
+
+        # read the version first: anything written meanwhile is sent again on the next sync
+        version = current_version()
+        statement = select(Item.iid, Item.description, Item.version)
+        if since > 0:
+            statement = statement.where(Item.version > since)
+        # since=0 is a full sync, which must include the items never written since versions were added
+        items = db.session.execute(statement).all()
+        totals = stock_totals(iids=[item.iid for item in items])
+
+        changes = []
+        for item in items:
+            item_totals = totals.get(item.iid, empty_totals())
+            changes.append({
+                "description": item.description,
+                "quantity": item_totals['purchase'] - item_totals['dispose'],
+                "loaned": item_totals['borrow'],
+                "version": item.version
+            })
+
+        return {"changes": changes, "count": len(changes), "version": version}, 200
+
+    @app.route('/api/add_box', methods=['POST'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    @idempotent
+    def add_box():
+        data = request.get_json()
+
+        description = data.get('description')
+        barcode = data.get('barcode')
+
+        if not description or not barcode:
+            return {'error': 'Description and barcode are required'}, 400
+        elif barcode_map.resolve([barcode]):
+            return {'error': 'Barcode already in use'}, 400
+
+        box = Box(description=description, barcode=barcode)
+        next_version('barcodes')
+        db.session.add(box)
+        db.session.commit()
+
+        app.logger.info(f'Added new box - {description} ({barcode})')
+
+        return {'message': 'Box added successfully', 'bid': box.bid}, 201
+
+    @app.route('/api/edit/add_content', methods=['POST'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    @idempotent
+    def add_content():
+        data = request.get_json()
+
+        bid = data.get('bid')
+        description = data.get('description')
+        quantity = data.get('quantity', 1)
+        iid = data.get('iid') or None
+
+        if not bid or not description:
+            return {'error': 'Box and description are required'}, 400
+
+        box = db.session.get(Box, bid)
+        if not box:
+            return {'error': 'No such box'}, 404
+        if iid is not None and not db.session.get(Item, iid):
+            return {'error': 'No such item'}, 400
+
+        content = Content(bid=bid, iid=iid, description=description.lower(), quantity=quantity)
+        db.session.add(content)
+        db.session.commit()
+
+        return {'message': f'Content {description} added succesfully to box {box.description}', 'id': content.cid}, 201
+
+    @app.route('/api/edit/remove_content', methods=['POST'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    @idempotent
+    def remove_content():
+        data = request.get_json()
+
+        cid = data.get('id')
+        content = db.session.get(Content, cid) if cid is not None else None
+
+        if not content or content.date_deleted is not None:
+            return {'error': 'No such content'}, 404
+
+        content.date_deleted = date.today()
+        db.session.commit()
+
+        return {'message': f'Content {cid} marked as deleted'}, 200
+
+    @app.route('/api/get_box_content', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def get_box_content():
+        bid = request.args.get('bid', type=int)
+        if bid is None:
+            bid = (request.get_json(silent=True) or {}).get('bid')
+
+        # Content.item is eager loaded, so this is a single joined query on the partial index
+        contents = Content.query.filter_by(bid=bid, date_deleted=None).all()
+
+        return {'contents': [content.serialize() for content in contents], 'quantity': len(contents)}, 200
+
+    @app.route('/api/scan', methods=['POST'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def scan():
+        """
+        Resolves one scanned code ({"code": ...}) or a batch ({"codes": [...]}) to boxes with
+        their contents and items with their stock, in a fixed number of queries per batch.
+        """
+        data = request.get_json()
+
+        single = 'code' in data
+        codes = [data['code']] if single else data.get('codes')
+        if not codes or not isinstance(codes, list) or not all(isinstance(code, str) and code for code in codes):
+            return {'error': 'A code or a list of codes is required'}, 400
+        if len(codes) > app.config.get('SCAN_BATCH_LIMIT', 200):
+            return {'error': 'Too many codes in one scan'}, 400
+
+        resolved = barcode_map.resolve(codes)
+        bids = [id for kind, id in resolved.values() if kind == 'box']
+        iids = [id for kind, id in resolved.values() if kind == 'item']
+
+        boxes = {box.bid: box for box in Box.query.options(joinedload(Box.contents)).filter(Box.bid.in_(bids))} if bids else {}
+        items = {item.iid: item for item in db.session.execute(select(Item.iid, Item.description).where(Item.iid.in_(iids)))} if iids else {}
+        totals = stock_totals(iids=iids) if iids else {}
+
+        results = []
+        for code in codes:
+            kind, id = resolved.get(code, (None, None))
+            if kind == 'box' and id in boxes:
+                box = boxes[id]
+                results.append({
+                    'code': code,
+                    'type': 'box',
+                    'bid': box.bid,
+                    'description': box.description,
+                    'contents': [content.serialize() for content in box.contents],
+                })
+            elif kind == 'item' and id in items:
+                item_totals = totals.get(id, empty_totals())
+                results.append({
+                    'code': code,
+                    'type': 'item',
+                    'iid': id,
+                    'description': items[id].description,
+                    'quantity': item_totals['purchase'] - item_totals['dispose'],
+                    'loaned': item_totals['borrow'],
+                })
+            else:
+                results.append({'code': code, 'type': None})
+
+        if single:
+            if results[0]['type'] is None:
+                return {'error': 'Unknown code', 'code': codes[0]}, 404
+            return results[0], 200
+
+        return {'results': results, 'count': len(results)}, 200
+
+    def load_job(job_id):
+        """Returns (job, None) for the submitter or an admin, or (None, error response)."""
+        fail_stale_jobs(app.config.get('JOB_LEASE_SECONDS', 60), Job.id == job_id)
+        job = db.session.get(Job, job_id)
+        if job is None:
+            return None, ({'error': 'No such job'}, 404)
+        if job.uid != session['user_id'] and not has_permission(session['user_id'], 'edit'):
+            return None, ({'error': 'No such job'}, 404)
+        return job, None
+
+    @app.route('/api/jobs', methods=['POST'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    @idempotent
+    def submit_job():
+        runner = app.extensions.get('jobs')
+        if runner is None:
+            return {'error': 'Background jobs are not available'}, 503
+
+        data = request.get_json() or {}
+        kind = JOB_KINDS.get(data.get('kind'))
+        params = data.get('params') or {}
+        if kind is None:
+            return {'error': f"Invalid job kind. Valid kinds are: {', '.join(JOB_KINDS)}"}, 400
+        if not isinstance(params, dict):
+            return {'error': 'params must be an object'}, 400
+        if kind.admin and not has_permission(session['user_id'], 'edit'):
+            return {'error': 'Edit permission required'}, 403
+
+        expire_results(app.config.get('JOB_RESULT_TTL_SECONDS', 7 * 24 * 3600))
+        fail_stale_jobs(app.config.get('JOB_LEASE_SECONDS', 60), Job.uid == session['user_id'])
+        pending = Job.query.filter(Job.uid == session['user_id'], Job.status.in_(('queued', 'running'))).count()
+        if pending >= app.config.get('JOB_MAX_PENDING_PER_USER', 5):
+            return {'error': 'Too many unfinished jobs'}, 429
+
+        job = runner.submit(data['kind'], params, session['user_id'])
+        app.logger.info(f"Queued job {job.id} ({job.kind}) for user {session['user_id']}")
+
+        return job.serialize(), 202, {'Location': f'/api/jobs/{job.id}'}
+
+    @app.route('/api/jobs/<int:job_id>', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def get_job(job_id):
+        job, error = load_job(job_id)
+        if error:
+            return error
+
+        return job.serialize(), 200
+
+    @app.route('/api/jobs/<int:job_id>/result', methods=['GET'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def get_job_result(job_id):
+        job, error = load_job(job_id)
+        if error:
+            return error
+        if job.status != 'succeeded':
+            return {'error': f'Job is {job.status}'}, 409
+        kind = JOB_KINDS.get(job.kind)
+        if kind is None or kind.extension is None:
+            return {'error': 'Job has no result'}, 404
+        if not job.result_path or not os.path.exists(job.result_path):
+            return {'error': 'Job result has expired'}, 410
+
+        return send_file(os.path.abspath(job.result_path), mimetype=job.result_mimetype, as_attachment=True)
+
+    @app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+    @cross_origin(supports_credentials=True)
+    @login_required
+    def cancel_job(job_id):
+        runner = app.extensions.get('jobs')
+        if runner is None:
+            return {'error': 'Background jobs are not available'}, 503
+        job, error = load_job(job_id)
+        if error:
+            return error
+        if job.status not in ('queued', 'running'):
+            return {'error': f'Job is {job.status}'}, 409
+
+        runner.cancel(job)
+
+        return job.serialize(), 202
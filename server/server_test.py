@@ -9,12 +9,15 @@ from models import User, Item, Box, Content, ItemUse
 
 
 @pytest.fixture
-def app():
+def app(request, tmp_path):
     """Create and configure a test Flask application."""
     app = Flask(__name__)
     app.config['TESTING'] = True
     app.config['SECRET_KEY'] = 'test-secret-key'
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    # test classes whose threads need connections of their own, which an in-memory database cannot give them
+    if getattr(request.cls, 'file_database', False):
+        app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'inventory.db'}"
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['SESSION_TYPE'] = 'filesystem'
     return app
@@ -30,6 +33,9 @@ def db(app):
         yield application_db
         application_db.session.remove()
         application_db.drop_all()
+    # user ids are reused by the next test's database
+    from permissions import users
+    users.clear()
 
 
 @pytest.fixture(scope='function')
@@ -41,6 +47,36 @@ def client(app, db):
         yield client
 
 
+@pytest.fixture
+def add_transaction(db):
+    """Add a transaction at midnight of a given day, optionally applying it to the aggregates."""
+    def add_transaction(iid, transaction_type, quantity, day, record=False):
+        from models import Transaction
+        from stock import record_transaction
+        from datetime import datetime
+        transaction = Transaction(iid=iid, uid=1, transaction_type=transaction_type,
+                                  quantity=quantity, date=datetime.combine(day, datetime.min.time()))
+        db.session.add(transaction)
+        if record:
+            record_transaction(transaction)
+        db.session.commit()
+        return transaction
+    return add_transaction
+
+
+@pytest.fixture
+def login(client, db):
+    """Log the test client in as a newly created user."""
+    def login(edit_permission=False):
+        user = User(username='leader', password='x', email='leader@example.com', edit_permission=edit_permission)
+        db.session.add(user)
+        db.session.commit()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user.uid
+        return user
+    return login
+
+
 @pytest.fixture
 def mock_user():
     """Create a mock user for testing."""
@@ -917,4 +953,1675 @@ class TestEdgeCases:
             # Verify the error handler returns the expected message
             # data = response.get_json()
             # assert 'error' in data
-            # assert data['error'] == 'Internal database error'
\ No newline at end of file
+            # assert data['error'] == 'Internal database error'
+
+class TestStockSnapshots:
+    """Test point-in-time stock queries backed by snapshots."""
+
+    def test_snapshot_plus_delta_matches_history(self, client, db, add_transaction):
+        """Test that totals from a snapshot equal a full replay."""
+        from stock import stock_totals, take_snapshot
+        item = Item(description='tent')
+        db.session.add(item)
+        db.session.commit()
+
+        add_transaction(item.iid, 'purchase', 10, date(2024, 1, 1))
+        add_transaction(item.iid, 'borrow', 3, date(2024, 1, 2))
+        take_snapshot()
+        add_transaction(item.iid, 'dispose', 2, date(2024, 1, 3))
+
+        totals = stock_totals()
+        assert totals[item.iid]['purchase'] == 10
+        assert totals[item.iid]['borrow'] == 3
+        assert totals[item.iid]['dispose'] == 2
+
+    def test_get_inventory_as_of(self, client, db, add_transaction):
+        """Test that as_of only counts transactions up to that date."""
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+
+        item = Item(description='tent')
+        db.session.add(item)
+        db.session.commit()
+        add_transaction(item.iid, 'purchase', 10, date(2024, 1, 1))
+        add_transaction(item.iid, 'purchase', 5, date(2024, 3, 1))
+
+        response = client.get('/api/get_inventory?as_of=2024-02-01')
+        assert response.status_code == 200
+        assert response.get_json()['inventory'][0]['quantity'] == 10
+
+        response = client.get('/api/get_inventory')
+        assert response.get_json()['inventory'][0]['quantity'] == 15
+
+    def test_get_inventory_invalid_as_of(self, client):
+        """Test that an unparsable as_of is rejected."""
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+
+        response = client.get('/api/get_inventory?as_of=yesterday')
+        assert response.status_code == 400
+
+
+class TestCompaction:
+    """Test transaction log compaction and archive restore."""
+
+    def test_compaction_keeps_totals(self, db, tmp_path, add_transaction):
+        """Test that folding old rows keeps stock totals exact."""
+        from compaction import compact_transactions
+        from stock import stock_totals
+        from models import Transaction
+        from datetime import datetime
+        item = Item(description='tent')
+        db.session.add(item)
+        db.session.commit()
+        for day in (1, 2, 3):
+            add_transaction(item.iid, 'purchase', day, date(2020, 1, day))
+        add_transaction(item.iid, 'purchase', 10, date(2024, 1, 1))
+        before = stock_totals()
+
+        path, folded = compact_transactions(datetime(2021, 1, 1), str(tmp_path))
+
+        assert folded == 3
+        assert Transaction.query.count() == 2
+        assert stock_totals() == before
+
+    def test_restore_archive(self, db, tmp_path, add_transaction):
+        """Test that restoring an archive brings back the original rows."""
+        from compaction import compact_transactions, restore_archive
+        from models import Transaction
+        from datetime import datetime
+        item = Item(description='tent')
+        db.session.add(item)
+        db.session.commit()
+        tids = [add_transaction(item.iid, 'borrow', 1, date(2020, 1, day)).tid for day in (1, 2)]
+
+        path, folded = compact_transactions(datetime(2021, 1, 1), str(tmp_path))
+        assert restore_archive(path) == 2
+
+        assert sorted(t.tid for t in Transaction.query.all()) == tids
+        assert not any(t.compacted for t in Transaction.query.all())
+
+
+class TestLoans:
+    """Test outstanding loan balances."""
+
+    def test_my_loans(self, client, db, login):
+        """Test that borrows minus returns are reported per item."""
+        login()
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 10})
+        client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 3})
+        client.post('/api/transaction/return', json={'item_description': 'tent', 'quantity': 1})
+
+        response = client.get('/api/me/loans')
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['count'] == 1
+        assert data['loans'][0]['description'] == 'tent'
+        assert data['loans'][0]['outstanding'] == 2
+
+    def test_returned_loans_are_hidden(self, client, db, login):
+        """Test that fully returned items are not listed."""
+        login()
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 10})
+        client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 2})
+        client.post('/api/transaction/return', json={'item_description': 'tent', 'quantity': 2})
+
+        assert client.get('/api/me/loans').get_json()['count'] == 0
+
+    def test_all_loans_requires_edit_permission(self, client, db, login):
+        """Test that the all-users view is admin only."""
+        login()
+        assert client.get('/api/loans').status_code == 403
+
+    def test_rebuild_matches_incremental(self, client, db, login):
+        """Test that rebuilding from the log gives the same balances."""
+        from models import LoanBalance
+        from stock import rebuild_aggregates
+        login(edit_permission=True)
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 10})
+        client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 4})
+        client.post('/api/transaction/return', json={'item_description': 'tent', 'quantity': 1})
+
+        before = [(b.uid, b.iid, b.outstanding) for b in LoanBalance.query.all()]
+        rebuild_aggregates()
+        after = [(b.uid, b.iid, b.outstanding) for b in LoanBalance.query.all()]
+        assert before == after == [(1, 1, 3)]
+        assert client.get('/api/loans').get_json()['count'] == 1
+
+
+class TestUsageReports:
+    """Test the daily usage rollups and report endpoints."""
+
+    def _setup(self, client, db, add_transaction):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        item = Item(description='tent')
+        db.session.add(item)
+        db.session.commit()
+        add_transaction(item.iid, 'purchase', 20, date(2023, 1, 1), record=True)
+        add_transaction(item.iid, 'borrow', 2, date(2023, 7, 1), record=True)
+        add_transaction(item.iid, 'borrow', 3, date(2023, 7, 1), record=True)
+        add_transaction(item.iid, 'borrow', 4, date(2024, 7, 15), record=True)
+        add_transaction(item.iid, 'borrow', 1, date(2024, 2, 3), record=True)
+        return item
+
+    def test_rollup_is_incremental(self, client, db, add_transaction):
+        """Test that transactions on the same day share a rollup row."""
+        from models import DailyUsage
+        item = self._setup(client, db, add_transaction)
+        row = DailyUsage.query.filter_by(iid=item.iid, day=date(2023, 7, 1)).one()
+        assert row.quantity == 5
+
+    def test_rebuild_matches_incremental(self, client, db, add_transaction):
+        """Test that rebuilding the rollups gives the same rows."""
+        from models import DailyUsage
+        from stock import rebuild_aggregates
+        self._setup(client, db, add_transaction)
+        rows = lambda: sorted((r.iid, r.day, r.transaction_type, r.quantity) for r in DailyUsage.query.all())
+        before = rows()
+        rebuild_aggregates()
+        assert rows() == before
+
+    def test_rebuild_keeps_compacted_days(self, client, db, tmp_path, add_transaction):
+        """Test that rebuilding after compaction leaves the usage of the folded days where it was."""
+        from models import DailyUsage
+        from stock import rebuild_aggregates
+        from compaction import compact_transactions
+        from datetime import datetime
+        item = self._setup(client, db, add_transaction)
+        add_transaction(item.iid, 'return', 2, date(2020, 7, 1), record=True)
+        add_transaction(item.iid, 'return', 3, date(2020, 12, 1), record=True)
+        rows = lambda: sorted((r.iid, r.day, r.transaction_type, r.quantity) for r in DailyUsage.query.all())
+        before = rows()
+
+        assert compact_transactions(datetime(2021, 1, 1), str(tmp_path))[1] == 2
+        rebuild_aggregates()
+        assert rows() == before
+
+    def test_usage_per_month(self, client, db, add_transaction):
+        """Test the monthly usage report."""
+        self._setup(client, db, add_transaction)
+        response = client.get('/api/reports/usage?period=month&type=borrow&from=2024-01-01')
+        assert response.status_code == 200
+        usage = response.get_json()['usage']
+        assert [(u['period'], u['quantity']) for u in usage] == [('2024-02', 1), ('2024-07', 4)]
+
+    def test_peak_months(self, client, db, add_transaction):
+        """Test that the busiest calendar month comes first."""
+        self._setup(client, db, add_transaction)
+        months = client.get('/api/reports/peak').get_json()['months']
+        assert months[0] == {'month': 7, 'quantity': 9}
+
+    def test_invalid_period(self, client):
+        """Test that an unknown period is rejected."""
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        assert client.get('/api/reports/usage?period=week').status_code == 400
+
+
+class TestChangeFeed:
+    """Test the server-sent events change feed."""
+
+    def test_feed_delivers_to_every_subscriber(self):
+        """Test that one publish reaches all subscribers."""
+        from events import ChangeFeed
+        feed = ChangeFeed()
+        start = feed.sequence
+        feed.publish([{'event': 'stock', 'iid': 1}])
+        assert feed.wait(start, timeout=0) == [(start + 1, {'event': 'stock', 'iid': 1})]
+        assert feed.wait(start, timeout=0) == [(start + 1, {'event': 'stock', 'iid': 1})]
+
+    def test_feed_reports_subscribers_that_fell_behind(self):
+        """Test that evicted events are reported as a reset."""
+        from events import ChangeFeed
+        feed = ChangeFeed(size=2)
+        feed.publish([{'n': 1}, {'n': 2}, {'n': 3}])
+        assert feed.wait(0, timeout=0) is None
+
+    def test_commit_publishes_stock_delta(self, client, db):
+        """Test that a committed transaction is published and a rolled back one is not."""
+        from events import feed, queue_event
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+
+        db.session.add(Item(description='lamp'))
+        db.session.flush()
+        queue_event({'event': 'item_added'})
+        db.session.rollback()
+        start = feed.sequence
+
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 4})
+
+        events = feed.wait(start, timeout=0)
+        assert len(events) == 1
+        assert events[0][1]['description'] == 'tent'
+        assert events[0][1]['quantity_delta'] == 4
+
+    def test_event_stream_resumes_from_last_event_id(self, client, db):
+        """Test that the stream replays events after Last-Event-ID."""
+        from events import feed
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        start = feed.sequence
+        feed.publish([{'event': 'stock', 'iid': 7}])
+
+        response = client.get('/api/inventory/events', headers={'Last-Event-ID': feed.event_id(start)}, buffered=False)
+        assert response.mimetype == 'text/event-stream'
+        chunks = iter(response.response)
+        assert next(chunks).startswith(b'retry:')
+        assert f'id: {feed.event_id(start + 1)}'.encode() in next(chunks)
+        response.close()
+
+    def test_event_id_of_other_epoch_resets(self, client, db):
+        """Test that resuming with an id from another process or run asks the client to reload."""
+        from events import feed
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        for stale_id in ('0123456789ab-1', '1'):
+            response = client.get('/api/inventory/events', headers={'Last-Event-ID': stale_id}, buffered=False)
+            chunks = iter(response.response)
+            next(chunks)
+            assert b'event: reset' in next(chunks)
+            response.close()
+
+    def test_event_streams_are_capped(self, app, client, db):
+        """Test that streams beyond the subscriber limit are refused until one closes."""
+        from events import feed
+        app.config['EVENTS_MAX_SUBSCRIBERS'] = 1
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+
+        first = client.get('/api/inventory/events', buffered=False)
+        assert first.status_code == 200
+        refused = client.get('/api/inventory/events', buffered=False)
+        assert refused.status_code == 503
+        assert refused.get_data().startswith(b'retry:')
+        first.close()
+
+        assert feed.subscribers == 0
+        second = client.get('/api/inventory/events', buffered=False)
+        assert second.status_code == 200
+        second.close()
+
+
+class TestInventoryChanges:
+    """Test delta syncs of the inventory."""
+
+    def test_changes_since_version(self, client, db):
+        """Test that only items written after the given version are returned."""
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/add_item', json={'description': 'tent'})
+        client.post('/api/add_item', json={'description': 'rope'})
+        version = client.get('/api/inventory/changes').get_json()['version']
+
+        client.post('/api/transaction/purchase', json={'item_description': 'rope', 'quantity': 6})
+
+        data = client.get(f'/api/inventory/changes?since={version}').get_json()
+        assert data['version'] > version
+        assert data['count'] == 1
+        assert data['changes'][0]['description'] == 'rope'
+        assert data['changes'][0]['quantity'] == 6
+
+    def test_no_changes(self, client, db):
+        """Test that an up to date client gets an empty list."""
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/add_item', json={'description': 'tent'})
+        version = client.get('/api/inventory/changes').get_json()['version']
+
+        data = client.get(f'/api/inventory/changes?since={version}').get_json()
+        assert data == {'changes': [], 'count': 0, 'version': version}
+
+    def test_full_sync_includes_unversioned_items(self, client, db):
+        """Test that a first sync returns items still at version 0, e.g. from before the upgrade."""
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        db.session.execute(db.text("INSERT INTO items (description, key, version, available) VALUES ('Rope', 'rope', 0, 0)"))
+        db.session.commit()
+        client.post('/api/add_item', json={'description': 'tent'})
+
+        data = client.get('/api/inventory/changes?since=0').get_json()
+        assert sorted(change['description'] for change in data['changes']) == ['Rope', 'tent']
+        assert client.get(f"/api/inventory/changes?since={data['version']}").get_json()['count'] == 0
+
+
+class TestResponses:
+    """Test JSON serialization and response compression."""
+
+    @pytest.fixture
+    def compressed_app(self, app):
+        from responses import register_responses
+        app.config['COMPRESS_MIN_SIZE'] = 100
+        register_responses(app)
+
+        @app.route('/payload/<int:size>')
+        def payload(size):
+            return {'items': ['x' * 10] * size}
+
+        return app
+
+    def test_large_response_is_gzipped(self, compressed_app):
+        """Test that responses above the threshold are compressed."""
+        import gzip, json
+        response = compressed_app.test_client().get('/payload/100', headers={'Accept-Encoding': 'gzip'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert json.loads(gzip.decompress(response.data)) == {'items': ['x' * 10] * 100}
+
+    def test_small_response_is_not_compressed(self, compressed_app):
+        """Test that responses below the threshold are sent as is."""
+        response = compressed_app.test_client().get('/payload/1', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in response.headers
+
+    def test_no_compression_without_accept_encoding(self, compressed_app):
+        """Test that clients that do not accept gzip get plain JSON."""
+        response = compressed_app.test_client().get('/payload/100', headers={'Accept-Encoding': 'identity'})
+        assert 'Content-Encoding' not in response.headers
+        assert response.get_json() == {'items': ['x' * 10] * 100}
+
+    def test_get_item_dates_are_iso(self, client, db):
+        """Test that transaction dates are serialized as ISO strings."""
+        from models import Transaction
+        from datetime import datetime
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        item = Item(description='tent')
+        db.session.add(item)
+        db.session.commit()
+        db.session.add(Transaction(iid=item.iid, uid=1, transaction_type='purchase', quantity=1, date=datetime(2024, 5, 1, 12, 30)))
+        db.session.commit()
+
+        data = client.get('/api/item/tent').get_json()
+        assert data['transaction_list'][0]['date'] == '2024-05-01T12:30:00'
+
+    def test_orjson_provider_matches_stdlib(self, app):
+        """Test that installing orjson does not change the values responses contain."""
+        pytest.importorskip('orjson')
+        import json
+        from datetime import datetime
+        from flask.json.provider import DefaultJSONProvider
+        from responses import OrjsonProvider
+        payload = {'when': datetime(2024, 5, 1, 12, 30), 'day': date(2024, 5, 1), 'big': 2 ** 70, 'n': 3}
+        expected = json.loads(DefaultJSONProvider(app).dumps(payload))
+        assert json.loads(OrjsonProvider(app).dumps(payload)) == expected
+        assert json.loads(OrjsonProvider(app).response(payload).get_data()) == expected
+
+
+class TestBoxContents:
+    """Test box contents queries and indexes."""
+
+    def test_box_content_excludes_deleted(self, client, db):
+        """Test that removed contents are not listed."""
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        box = Box(description='Kitchen', barcode='BOX042')
+        item = Item(description='pan')
+        db.session.add_all([box, item])
+        db.session.commit()
+        kept = Content(bid=box.bid, iid=item.iid, description='pan', quantity=2)
+        removed = Content(bid=box.bid, description='lid', quantity=1, date_deleted=date.today())
+        db.session.add_all([kept, removed])
+        db.session.commit()
+
+        data = client.get(f'/api/get_box_content?bid={box.bid}').get_json()
+        assert data['quantity'] == 1
+        assert data['contents'][0]['item'] == 'pan'
+
+    def test_box_content_is_one_query(self, client, db):
+        """Test that contents and their items are loaded in a single query."""
+        from sqlalchemy import event
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        box = Box(description='Kitchen', barcode='BOX042')
+        db.session.add(box)
+        db.session.commit()
+        bid = box.bid
+        for n in range(3):
+            item = Item(description=f'pan {n}')
+            db.session.add(item)
+            db.session.flush()
+            db.session.add(Content(bid=box.bid, iid=item.iid, description=f'pan {n}'))
+        db.session.commit()
+        db.session.expunge_all()
+
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            client.get(f'/api/get_box_content?bid={bid}')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert len([s for s in statements if 'FROM contents' in s]) == 1
+        assert not [s for s in statements if s.lstrip().startswith('SELECT') and 'FROM items' in s and 'contents' not in s]
+
+    def test_duplicate_barcode_rejected(self, client, db):
+        """Test that barcodes are unique."""
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/add_box', json={'description': 'Kitchen', 'barcode': 'BOX042'})
+        response = client.post('/api/add_box', json={'description': 'Other', 'barcode': 'BOX042'})
+        assert response.status_code == 400
+
+    def test_partial_index_exists(self, db):
+        """Test that active contents are covered by a partial index."""
+        rows = db.session.execute(db.text("SELECT sql FROM sqlite_master WHERE name = 'ix_contents_active_bid'")).all()
+        assert 'WHERE date_deleted IS NULL' in rows[0][0]
+
+
+class TestScan:
+    """Test barcode scans."""
+
+    def _setup(self, client, db):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/add_box', json={'description': 'Kitchen', 'barcode': 'BOX1'})
+        client.post('/api/add_item', json={'description': 'stove', 'barcode': 'ITEM1'})
+        client.post('/api/transaction/purchase', json={'item_description': 'stove', 'quantity': 3})
+        box = Box.query.filter_by(barcode='BOX1').one()
+        client.post('/api/edit/add_content', json={'bid': box.bid, 'description': 'Pan', 'quantity': 2})
+
+    def test_scan_box(self, client, db):
+        """Test that scanning a box returns its contents."""
+        self._setup(client, db)
+        response = client.post('/api/scan', json={'code': 'BOX1'})
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['type'] == 'box'
+        assert [c['description'] for c in data['contents']] == ['pan']
+
+    def test_scan_batch(self, client, db):
+        """Test that a batch resolves boxes, items and unknown codes in order."""
+        self._setup(client, db)
+        data = client.post('/api/scan', json={'codes': ['ITEM1', 'NOPE', 'BOX1']}).get_json()
+        assert [r['type'] for r in data['results']] == ['item', None, 'box']
+        assert data['results'][0]['quantity'] == 3
+
+    def test_scan_unknown_code(self, client, db):
+        """Test that a single unknown code is a 404."""
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        assert client.post('/api/scan', json={'code': 'NOPE'}).status_code == 404
+
+    def test_barcodes_are_shared_between_boxes_and_items(self, client, db):
+        """Test that an item cannot reuse a box barcode."""
+        self._setup(client, db)
+        response = client.post('/api/add_item', json={'description': 'kettle', 'barcode': 'BOX1'})
+        assert response.status_code == 400
+
+    def test_barcode_map_reloads_on_version_change(self, db):
+        """Test that the map picks up barcodes written by other workers."""
+        from barcodes import BarcodeMap
+        from stock import next_version
+        barcodes = BarcodeMap()
+        assert barcodes.resolve(['BOX9']) == {}
+        box = Box(description='Tools', barcode='BOX9')
+        db.session.add(box)
+        next_version('barcodes')
+        db.session.commit()
+        assert barcodes.resolve(['BOX9']) == {'BOX9': ('box', box.bid)}
+
+
+class TestIdempotency:
+    """Test Idempotency-Key handling on write routes."""
+
+    def _setup(self, client, db):
+        user = User(username='leader', password='x', email='leader@example.com')
+        db.session.add_all([user, Item(description='tent')])
+        db.session.commit()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user.uid
+
+    @pytest.fixture(autouse=True)
+    def clear_cache(self):
+        from idempotency import responses
+        responses.clear()
+
+    def test_retry_does_not_duplicate_transaction(self, client, db):
+        """Test that a retried transaction is only written once."""
+        from models import Transaction
+        self._setup(client, db)
+        headers = {'Idempotency-Key': 'abc'}
+        first = client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2}, headers=headers)
+        second = client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2}, headers=headers)
+
+        assert first.status_code == second.status_code == 200
+        assert second.headers['Idempotent-Replayed'] == 'true'
+        assert second.get_json() == first.get_json()
+        assert Transaction.query.count() == 1
+
+    def test_replay_from_shared_store(self, client, db):
+        """Test that a retry handled by another worker is replayed from the database."""
+        from models import Transaction
+        from idempotency import responses
+        self._setup(client, db)
+        headers = {'Idempotency-Key': 'abc'}
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2}, headers=headers)
+        responses.clear()
+
+        response = client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2}, headers=headers)
+        assert response.headers['Idempotent-Replayed'] == 'true'
+        assert Transaction.query.count() == 1
+
+    def test_key_reused_for_other_route(self, client, db):
+        """Test that a key cannot be reused for a different request."""
+        self._setup(client, db)
+        headers = {'Idempotency-Key': 'abc'}
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2}, headers=headers)
+        response = client.post('/api/add_box', json={'description': 'Kitchen', 'barcode': 'BOX1'}, headers=headers)
+        assert response.status_code == 422
+
+    def test_key_reused_with_other_body(self, client, db):
+        """Test that a key cannot be reused for the same route with a different body."""
+        from idempotency import responses
+        self._setup(client, db)
+        headers = {'Idempotency-Key': 'abc'}
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2}, headers=headers)
+        response = client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 3}, headers=headers)
+        assert response.status_code == 422
+        responses.clear()
+        response = client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 3}, headers=headers)
+        assert response.status_code == 422
+
+    def test_replay_keeps_mimetype_and_location(self, client, db):
+        """Test that a replay from the shared store restores the response's media type and Location header."""
+        from models import IdempotencyKey
+        self._setup(client, db)
+        db.session.add(IdempotencyKey(uid=1, key='abc', method='POST', path='/api/jobs', status_code=202,
+                                      body='queued', mimetype='text/plain', headers='{"Location": "/api/jobs/7"}'))
+        db.session.commit()
+
+        response = client.post('/api/jobs', json={'kind': 'usage_report'}, headers={'Idempotency-Key': 'abc'})
+        assert response.status_code == 202
+        assert response.mimetype == 'text/plain'
+        assert response.headers['Location'] == '/api/jobs/7'
+        assert response.get_data(as_text=True) == 'queued'
+
+    def test_abandoned_claim_is_taken_over(self, client, db):
+        """Test that a key whose first request never answered runs again once its lease is over."""
+        from models import IdempotencyKey, Transaction
+        from idempotency import request_hash
+        from datetime import datetime, timedelta
+        self._setup(client, db)
+        body = {'item_description': 'tent', 'quantity': 2}
+        with client.application.test_request_context(json=body):
+            digest = request_hash()
+        for key, created_at in (('fresh', datetime.now()), ('abandoned', datetime.now() - timedelta(minutes=5))):
+            db.session.add(IdempotencyKey(uid=1, key=key, method='POST', path='/api/transaction/purchase',
+                                          request_hash=digest, created_at=created_at))
+        db.session.commit()
+
+        assert client.post('/api/transaction/purchase', json=body, headers={'Idempotency-Key': 'fresh'}).status_code == 409
+        response = client.post('/api/transaction/purchase', json=body, headers={'Idempotency-Key': 'abandoned'})
+        assert response.status_code == 200
+        assert 'Idempotent-Replayed' not in response.headers
+        assert Transaction.query.count() == 1
+
+    def test_without_key_every_request_runs(self, client, db):
+        """Test that requests without a key are not deduplicated."""
+        from models import Transaction
+        self._setup(client, db)
+        for _ in range(2):
+            client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2})
+        assert Transaction.query.count() == 2
+
+    def test_response_cache_is_bounded(self):
+        """Test that the per-worker cache evicts the least recently used keys."""
+        from idempotency import ResponseCache
+        cache = ResponseCache(size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+
+    def test_cached_response_expires_with_configured_ttl(self, app, client, db):
+        """Test that the per-worker cache forgets keys after IDEMPOTENCY_TTL_SECONDS, like the shared store."""
+        import time
+        from idempotency import responses
+        app.config['IDEMPOTENCY_TTL_SECONDS'] = 60
+        self._setup(client, db)
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2}, headers={'Idempotency-Key': 'abc'})
+        cache_key = next(iter(responses._entries))
+
+        with patch('idempotency.time.monotonic', return_value=time.monotonic() + 61):
+            assert responses.get(cache_key) is None
+
+    def test_eviction_bounds_shared_store(self, client, db):
+        """Test that the shared store keeps at most IDEMPOTENCY_MAX_KEYS keys."""
+        from models import IdempotencyKey
+        from idempotency import evict
+        from datetime import datetime, timedelta
+        from flask import current_app
+        self._setup(client, db)
+        now = datetime.now()
+        db.session.add_all(IdempotencyKey(uid=1, key=str(n), method='POST', path='/', status_code=200, body='{}',
+                                          created_at=now - timedelta(minutes=n)) for n in range(5))
+        db.session.commit()
+        current_app.config['IDEMPOTENCY_MAX_KEYS'] = 3
+        evict()
+        assert sorted(k.key for k in IdempotencyKey.query.all()) == ['0', '1', '2']
+
+
+class TestGroupCommit:
+    """Test the group-commit writer."""
+
+    file_database = True
+
+    def test_queued_inserts_share_one_commit(self, app, db):
+        """Test that transactions queued together are committed together."""
+        from group_commit import GroupCommitWriter
+        from models import Transaction
+        from sqlalchemy import event
+        from sqlalchemy.orm import Session
+        item = Item(description='tent')
+        db.session.add(item)
+        db.session.commit()
+
+        writer = GroupCommitWriter(app, interval=0.05)
+        futures = [writer.submit(iid=item.iid, uid=1, transaction_type='purchase', quantity=1) for _ in range(5)]
+
+        commits = []
+        listener = lambda session: commits.append(session)
+        event.listen(Session, 'after_commit', listener)
+        try:
+            writer.start()
+            tids = [future.result(timeout=5) for future in futures]
+        finally:
+            event.remove(Session, 'after_commit', listener)
+
+        assert len(commits) == 1
+        assert sorted(tids) == sorted(t.tid for t in Transaction.query.all())
+
+    def test_failing_row_does_not_fail_its_group(self, app, db):
+        """Test that a bad row only fails its own request."""
+        from group_commit import GroupCommitWriter
+        item = Item(description='tent')
+        db.session.add(item)
+        db.session.commit()
+
+        writer = GroupCommitWriter(app, interval=0.05)
+        good = writer.submit(iid=item.iid, uid=1, transaction_type='purchase', quantity=1)
+        bad = writer.submit(iid=item.iid, uid=1, transaction_type='purchase', quantity=None)
+        writer.start()
+
+        assert good.result(timeout=5)
+        with pytest.raises(Exception):
+            bad.result(timeout=5)
+
+    def test_add_transaction_through_writer(self, app, client, db):
+        """Test that add_transaction waits for the writer when group commit is enabled."""
+        from group_commit import init_group_commit
+        from models import Transaction
+        init_group_commit(app)
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+
+        response = client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2})
+        assert response.status_code == 200
+        assert Transaction.query.one().quantity == 2
+
+    def test_timed_out_row_is_withdrawn(self, app, client, db):
+        """Test that a request answered with 503 never has its row written by a late writer."""
+        from group_commit import GroupCommitWriter
+        from models import Transaction
+        app.config['GROUP_COMMIT_TIMEOUT'] = 0.05
+        # not started: the row stays queued past the timeout
+        writer = app.extensions['group_commit'] = GroupCommitWriter(app, interval=0.01)
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+
+        headers = {'Idempotency-Key': 'purchase-1'}
+        response = client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2}, headers=headers)
+        assert response.status_code == 503
+
+        writer.start()
+        response = client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2}, headers=headers)
+        assert response.status_code == 200
+        db.session.expire_all()
+        assert Transaction.query.count() == 1
+
+    def test_taken_row_is_waited_for(self, app, client, db):
+        """Test that a row the writer already took is reported once it is committed, not as a 503."""
+        import time
+        from group_commit import GroupCommitWriter, init_group_commit
+        from models import Transaction
+        app.config['GROUP_COMMIT_TIMEOUT'] = 0.05
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+
+        insert = GroupCommitWriter._insert
+        def slow_insert(writer, values):
+            time.sleep(0.2)
+            return insert(writer, values)
+        with patch.object(GroupCommitWriter, '_insert', slow_insert):
+            init_group_commit(app)
+            response = client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2})
+        assert response.status_code == 200
+        db.session.expire_all()
+        assert Transaction.query.count() == 1
+
+
+class TestStockChecks:
+    """Test that borrows and disposals cannot exceed the available stock."""
+
+    def _setup(self, client, db, stock):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': stock})
+
+    def test_over_borrow_rejected(self, client, db):
+        """Test that borrowing more than is available is a conflict and writes nothing."""
+        from models import Transaction
+        self._setup(client, db, 3)
+        response = client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 4})
+        assert response.status_code == 409
+        assert Transaction.query.count() == 1
+        assert Item.query.one().available == 3
+
+    def test_borrowed_units_cannot_be_disposed(self, client, db):
+        """Test that units out on loan are not available for disposal."""
+        self._setup(client, db, 3)
+        assert client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 2}).status_code == 200
+        assert client.post('/api/transaction/dispose', json={'item_description': 'tent', 'quantity': 2}).status_code == 409
+        assert client.post('/api/transaction/return', json={'item_description': 'tent', 'quantity': 2}).status_code == 200
+        assert client.post('/api/transaction/dispose', json={'item_description': 'tent', 'quantity': 2}).status_code == 200
+        assert Item.query.one().available == 1
+
+    def test_return_needs_outstanding_loan(self, client, db):
+        """Test that returning more than the user has on loan is a conflict and adds no stock."""
+        from models import Transaction
+        self._setup(client, db, 3)
+        response = client.post('/api/transaction/return', json={'item_description': 'tent', 'quantity': 1})
+        assert response.status_code == 409
+        assert 'on loan' in response.get_json()['error']
+        assert client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 2}).status_code == 200
+        assert client.post('/api/transaction/return', json={'item_description': 'tent', 'quantity': 3}).status_code == 409
+        assert client.post('/api/transaction/return', json={'item_description': 'tent', 'quantity': 2}).status_code == 200
+        assert Transaction.query.count() == 3
+        assert Item.query.one().available == 3
+
+    def test_invalid_quantity(self, client, db):
+        """Test that non-positive or non-numeric quantities are rejected."""
+        self._setup(client, db, 3)
+        assert client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': -1}).status_code == 400
+        assert client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 'many'}).status_code == 400
+
+    def test_rebuild_recomputes_available(self, client, db):
+        """Test that rebuilding restores the counter from the log."""
+        from stock import rebuild_aggregates
+        self._setup(client, db, 5)
+        client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 2})
+        item = Item.query.one()
+        item.available = 0
+        db.session.commit()
+        rebuild_aggregates()
+        assert Item.query.one().available == 3
+
+
+class TestReadRouting:
+    """Test that read-only requests use the read-only engine."""
+
+    @pytest.fixture
+    def routed_app(self, app, tmp_path):
+        from sessions import read_only_uri, READ_BIND
+        uri = f"sqlite:///{tmp_path / 'inventory.db'}"
+        app.config['SQLALCHEMY_DATABASE_URI'] = uri
+        app.config['SQLALCHEMY_BINDS'] = {READ_BIND: read_only_uri(uri)}
+        return app
+
+    @pytest.fixture
+    def routed_db(self, routed_app):
+        from app import db as application_db
+        from sessions import register_read_routing, READ_BIND
+        application_db.init_app(routed_app)
+        register_read_routing(routed_app, application_db)
+        with routed_app.app_context():
+            application_db.create_all()
+            yield application_db
+            application_db.session.remove()
+            application_db.drop_all()
+        # init_app registered a metadata for the bind on the shared db, later apps do not have it
+        application_db.metadatas.pop(READ_BIND, None)
+
+    def _statements(self, engine):
+        from sqlalchemy import event
+        statements = []
+        event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        return statements
+
+    def test_read_only_uri(self):
+        """Test deriving the mode=ro URI for SQLite files only."""
+        from sessions import read_only_uri
+        assert read_only_uri('sqlite:///./inventory.db') == 'sqlite:///file:./inventory.db?mode=ro&uri=true'
+        assert read_only_uri('sqlite:///:memory:') is None
+        assert read_only_uri('postgresql://localhost/inventory') is None
+
+    def test_get_uses_read_engine_and_post_uses_primary(self, routed_app, routed_db):
+        """Test that GET queries go to the read engine and writes to the primary."""
+        from sessions import READ_BIND
+        client = routed_app.test_client()
+        register_routes(routed_app, routed_db, Bcrypt(routed_app))
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        reads = self._statements(routed_db.engines[READ_BIND])
+        writes = self._statements(routed_db.engines[None])
+
+        assert client.post('/api/add_item', json={'description': 'tent'}).status_code == 200
+        assert reads == []
+        writes.clear()
+
+        assert client.get('/api/get_inventory').get_json()['count'] == 1
+        assert reads and not writes
+
+    def test_warm_up_uses_read_engine(self, routed_app, routed_db):
+        """Test that the startup warm-up runs its queries on the engine GET requests use."""
+        from sessions import READ_BIND
+        from health import warm_caches
+        routed_db.session.add(Item(description='tent', barcode='T-1'))
+        routed_db.session.commit()
+        reads = self._statements(routed_db.engines[READ_BIND])
+        writes = self._statements(routed_db.engines[None])
+
+        with routed_app.test_request_context():
+            warm_caches(routed_db)
+        assert any('FROM items' in statement for statement in reads)
+        assert not any('FROM items' in statement for statement in writes)
+
+    def test_bulk_item_post_uses_read_engine(self, routed_app, routed_db):
+        """Test that the bulk item lookup reads from the read engine although it is a POST."""
+        from sessions import READ_BIND
+        client = routed_app.test_client()
+        register_routes(routed_app, routed_db, Bcrypt(routed_app))
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        client.post('/api/add_item', json={'description': 'tent'})
+        reads = self._statements(routed_db.engines[READ_BIND])
+        writes = self._statements(routed_db.engines[None])
+
+        assert client.post('/api/items', json={'descriptions': ['tent']}).get_json()['count'] == 1
+        assert reads and not writes
+
+    def test_read_engine_cannot_write(self, routed_db):
+        """Test that the read engine is opened read-only."""
+        from sessions import READ_BIND
+        from sqlalchemy.exc import OperationalError
+        with routed_db.engines[READ_BIND].connect() as connection:
+            with pytest.raises(OperationalError):
+                connection.execute(routed_db.text("INSERT INTO items (description) VALUES ('x')"))
+
+
+class TestColumnarInventory:
+    """Test the columnar inventory format."""
+
+    def _setup(self, client, db):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        for description in ('tent', 'axe'):
+            client.post('/api/add_item', json={'description': description})
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 4})
+
+    def test_columnar_query_parameter(self, client, db):
+        """Test that ?format=columnar returns parallel arrays in the usual order."""
+        self._setup(client, db)
+        data = client.get('/api/get_inventory?format=columnar').get_json()
+        assert data['format'] == 'columnar'
+        assert data['count'] == 2
+        assert data['columns']['description'] == ['axe', 'tent']
+        assert data['columns']['quantity'] == [0, 4]
+        assert data['columns']['loaned'] == [0, 0]
+
+    def test_columnar_accept_header(self, client, db):
+        """Test that the vendor media type selects the columnar format."""
+        self._setup(client, db)
+        response = client.get('/api/get_inventory', headers={'Accept': 'application/vnd.kazou.columnar+json'})
+        assert response.get_json()['format'] == 'columnar'
+        assert 'Accept' in response.headers['Vary']
+
+    def test_columnar_description_ids(self, client, db):
+        """Test that descriptions can be replaced by item ids."""
+        self._setup(client, db)
+        data = client.get('/api/get_inventory?format=columnar&descriptions=ids').get_json()
+        assert data['fields'] == ['iid', 'quantity', 'loaned']
+        assert 'description' not in data['columns']
+
+    def test_default_format_unchanged(self, client, db):
+        """Test that the row format is still the default."""
+        self._setup(client, db)
+        data = client.get('/api/get_inventory').get_json()
+        assert data['inventory'][1] == {'description': 'tent', 'quantity': 4, 'loaned': 0}
+
+
+class TestLocations:
+    """Test per-location stock."""
+
+    def _setup(self, client, db):
+        user = User(username='leader', password='x', email='leader@example.com', edit_permission=True)
+        db.session.add(user)
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user.uid
+        for name in ('north', 'south'):
+            assert client.post('/api/add_location', json={'name': name}).status_code == 201
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 5, 'location': 'north'})
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2, 'location': 'south'})
+
+    def test_inventory_per_location(self, client, db):
+        """Test that inventory can be read for one location or for all of them."""
+        self._setup(client, db)
+        client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 1, 'location': 'north'})
+        north = client.get('/api/get_inventory?location=north').get_json()
+        assert north['inventory'] == [{'description': 'tent', 'quantity': 5, 'loaned': 1}]
+        south = client.get('/api/get_inventory?location=south').get_json()
+        assert south['inventory'] == [{'description': 'tent', 'quantity': 2, 'loaned': 0}]
+        everywhere = client.get('/api/get_inventory').get_json()
+        assert everywhere['inventory'] == [{'description': 'tent', 'quantity': 7, 'loaned': 1}]
+
+    def test_stock_is_checked_per_location(self, client, db):
+        """Test that stock at one location cannot be borrowed at another."""
+        from models import LocationStock
+        self._setup(client, db)
+        response = client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 3, 'location': 'south'})
+        assert response.status_code == 409
+        assert Item.query.one().available == 7
+        assert sorted(stock.available for stock in LocationStock.query) == [2, 5]
+
+    def test_unknown_location(self, client, db):
+        """Test that unknown locations are rejected."""
+        self._setup(client, db)
+        response = client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 1, 'location': 'west'})
+        assert response.status_code == 400
+        assert client.get('/api/get_inventory?location=west').status_code == 404
+
+    def test_rebuild_matches_incremental(self, client, db):
+        """Test that rebuilding the location aggregates from the log gives the same totals."""
+        from models import LocationStock
+        from stock import rebuild_aggregates
+        self._setup(client, db)
+        client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 2, 'location': 'north'})
+        before = sorted((s.lid, s.iid, s.borrowed, s.purchased, s.available) for s in LocationStock.query)
+        rebuild_aggregates()
+        after = sorted((s.lid, s.iid, s.borrowed, s.purchased, s.available) for s in LocationStock.query)
+        assert before == after
+
+    def test_location_reads_use_lid_index(self, client, db):
+        """Test that reading one location's stock is a primary key range search."""
+        self._setup(client, db)
+        plan = db.session.execute(db.text("EXPLAIN QUERY PLAN SELECT * FROM location_stock WHERE lid = 1")).all()
+        assert 'USING INDEX' in plan[0][-1] and 'lid=?' in plan[0][-1]
+
+
+class TestProfiling:
+    """Test on-demand request profiling."""
+
+    def _setup(self, app, client, db, tmp_path, edit_permission=True, profiler='cprofile'):
+        from profiling import register_profiling
+        app.config['PROFILE_DIR'] = str(tmp_path)
+        app.config['PROFILER'] = profiler
+        register_profiling(app)
+        user = User(username='leader', password='x', email='leader@example.com', edit_permission=edit_permission)
+        db.session.add(user)
+        db.session.commit()
+        with client.session_transaction() as sess:
+            sess['user_id'] = user.uid
+
+    def test_admin_request_is_profiled(self, app, client, db, tmp_path):
+        """Test that the header makes an admin's request write a loadable profile."""
+        import pstats
+        self._setup(app, client, db, tmp_path)
+        response = client.get('/api/get_inventory', headers={'X-Profile': '1'})
+        assert response.status_code == 200
+        name = response.headers['X-Profile']
+        assert name.startswith('get_inventory-') and name.endswith('.prof')
+        assert pstats.Stats(str(tmp_path / name)).total_calls > 0
+
+    def test_unflagged_or_unauthorized_requests_are_not_profiled(self, app, client, db, tmp_path):
+        """Test that only flagged requests from admins are profiled."""
+        self._setup(app, client, db, tmp_path, edit_permission=False)
+        assert 'X-Profile' not in client.get('/api/get_inventory').headers
+        assert 'X-Profile' not in client.get('/api/get_inventory?profile=1').headers
+        assert list(tmp_path.iterdir()) == []
+
+    def test_sampling_profiler_writes_folded_stacks(self, tmp_path):
+        """Test that the sampling profiler writes stack counts for flame graphs."""
+        from profiling import StackSampler
+        import time
+        sampler = StackSampler(interval=0.001)
+        sampler.enable()
+        deadline = time.monotonic() + 0.05
+        while time.monotonic() < deadline:
+            pass
+        sampler.disable()
+        path = tmp_path / 'busy.folded'
+        sampler.dump_stats(str(path))
+        stack, count = path.read_text().splitlines()[0].rsplit(' ', 1)
+        assert 'test_sampling_profiler_writes_folded_stacks' in stack
+        assert int(count) > 0
+
+
+class TestSlowQueryLog:
+    """Test the slow query log."""
+
+    @pytest.fixture(autouse=True)
+    def clear_stats(self):
+        from querylog import slow_queries
+        slow_queries.clear()
+        yield
+        slow_queries.clear()
+
+    def test_fingerprint_folds_literals_and_in_lists(self):
+        """Test that statements differing only in literals share a fingerprint."""
+        from querylog import fingerprint
+        assert fingerprint("SELECT * FROM items WHERE iid IN (?, ?, ?)") == fingerprint("SELECT * FROM items\n WHERE iid IN (?)")
+        assert fingerprint("SELECT * FROM items WHERE description = 'tent' LIMIT 10") == "SELECT * FROM items WHERE description = ? LIMIT ?"
+
+    def test_parameter_shape_hides_values(self):
+        """Test that only parameter types are logged."""
+        from querylog import parameter_shape
+        assert parameter_shape(('secret', 3)) == '(str, int)'
+        assert parameter_shape({'name': 'secret'}) == '{name: str}'
+        assert parameter_shape([(1,), (2,)], executemany=True) == '2 x (int)'
+
+    def test_slow_statements_are_logged_with_plan(self, app, client, db, caplog):
+        """Test that statements over the threshold are logged, explained and aggregated per route."""
+        from querylog import register_query_log, slow_queries
+        app.config['SLOW_QUERY_MS'] = 0
+        register_query_log(app, db)
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+
+        with caplog.at_level('WARNING'):
+            client.get('/api/item/tent')
+        assert any('plan:' in record.getMessage() and 'in get_item' in record.getMessage() for record in caplog.records)
+
+        top = slow_queries.top()
+        assert top and all(stats['count'] >= 1 for stats in top)
+        assert any('get_item' in stats['routes'] and 'FROM transations' in stats['fingerprint'] for stats in top)
+
+    def test_failed_plan_keeps_transaction_usable(self):
+        """Test that on PostgreSQL a failing EXPLAIN is rolled back to a savepoint, not the transaction."""
+        from querylog import explain
+        connection = MagicMock()
+        connection.dialect.name = 'postgresql'
+        cursor = connection.connection.cursor.return_value
+        executed = []
+        def execute(statement, parameters=None):
+            executed.append(statement.split(' ', 1)[0] if statement.startswith('EXPLAIN') else statement)
+            if statement.startswith('EXPLAIN'):
+                raise RuntimeError('cannot explain')
+        cursor.execute.side_effect = execute
+
+        with pytest.raises(RuntimeError):
+            explain(connection, 'SELECT 1', {})
+        assert executed == ['SAVEPOINT explain_plan', 'EXPLAIN', 'ROLLBACK TO SAVEPOINT explain_plan', 'RELEASE SAVEPOINT explain_plan']
+        cursor.close.assert_called_once()
+
+
+class TestHealth:
+    """Test the liveness and readiness endpoints."""
+
+    @pytest.fixture
+    def readiness(self, app, client, db):
+        from health import register_health
+        app.config['STARTUP_CHECKS'] = False
+        return register_health(app, db)
+
+    def test_healthz_needs_no_login(self, client, readiness):
+        """Test that liveness answers without a session or any check."""
+        response = client.get('/healthz')
+        assert response.status_code == 200
+        assert response.get_json() == {'status': 'ok'}
+
+    def test_not_ready_until_warmed_up(self, app, client, db, readiness):
+        """Test that readiness turns green after the startup checks."""
+        from health import warm_up
+        assert client.get('/readyz').status_code == 503
+
+        db.session.add(Item(description='tent', barcode='T-1'))
+        db.session.commit()
+        warm_up(app, db, readiness)
+
+        response = client.get('/readyz')
+        assert response.status_code == 200
+        assert response.get_json()['checks'] == {'connections': 'ok', 'schema': 'ok', 'caches': 'ok'}
+
+    def test_missing_tables_fail_readiness(self, app, client, db, readiness):
+        """Test that an incomplete schema keeps the worker out of rotation."""
+        from health import warm_up
+        db.session.execute(db.text('DROP TABLE counters'))
+        db.session.commit()
+        warm_up(app, db, readiness)
+
+        data = client.get('/readyz').get_json()
+        assert data['status'] == 'failed'
+        assert data['checks']['schema'] == 'failed'
+        assert 'counters' in data['error']
+
+    def test_ready_without_warming_caches(self, app, client, db):
+        """Test that disabling the cache warm-up still runs the other checks and turns ready."""
+        from health import register_health
+        app.config['WARM_UP_ON_START'] = False
+        readiness = register_health(app, db)
+        assert readiness._ready.wait(timeout=5)
+
+        response = client.get('/readyz')
+        assert response.status_code == 200
+        assert response.get_json()['checks'] == {'connections': 'ok', 'schema': 'ok'}
+
+
+class TestTransactionDates:
+    """Test transaction timestamps and date range queries."""
+
+    def _setup(self, client, db):
+        from models import Transaction
+        from datetime import datetime
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        item = Item(description='tent')
+        db.session.add(item)
+        db.session.flush()
+        for day in (1, 15, 28):
+            db.session.add(Transaction(iid=item.iid, uid=1, transaction_type='purchase', quantity=day, date=datetime(2024, 2, day, 12)))
+        db.session.commit()
+
+    def test_date_is_set_per_insert(self, client, db):
+        """Test that each transaction gets the time of its own insert, not of the import."""
+        from models import Transaction
+        from datetime import datetime, timedelta
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 1})
+        assert datetime.now() - Transaction.query.one().date < timedelta(minutes=1)
+
+    def test_item_history_date_range(self, client, db):
+        """Test that item history can be limited to a date range, with inclusive bare dates."""
+        self._setup(client, db)
+        data = client.get('/api/item/tent?from=2024-02-10&to=2024-02-28').get_json()
+        assert [transaction['quantity'] for transaction in data['transaction_list']] == [15, 28]
+        assert client.get('/api/item/tent?from=yesterday').status_code == 400
+
+    def test_history_range_uses_item_date_index(self, client, db):
+        """Test that the history of one item in a date range is an index search."""
+        from models import Transaction
+        from datetime import datetime
+        self._setup(client, db)
+        query = Transaction.query.filter(Transaction.iid == 1, Transaction.date >= datetime(2024, 2, 10)) \
+            .order_by(Transaction.date, Transaction.tid)
+        sql = str(query.statement.compile(db.engine, compile_kwargs={'literal_binds': True}))
+        plan = ' '.join(row[-1] for row in db.session.execute(db.text('EXPLAIN QUERY PLAN ' + sql)))
+        assert 'ix_transations_iid_date' in plan
+
+
+class TestJobs:
+    """Test the background job runner."""
+
+    file_database = True
+
+    @pytest.fixture
+    def runner(self, app, tmp_path):
+        from jobs import init_job_runner
+        app.config['JOB_DIR'] = str(tmp_path / 'jobs')
+        runner = init_job_runner(app)
+        yield runner
+        runner._executor.shutdown(wait=True, cancel_futures=True)
+
+    def _wait(self, client, job_id, statuses=('succeeded', 'failed', 'cancelled')):
+        import time
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            job = client.get(f'/api/jobs/{job_id}').get_json()
+            if job['status'] in statuses:
+                return job
+            time.sleep(0.01)
+        raise AssertionError(f"Job {job_id} is still {job['status']}")
+
+    def test_export_runs_in_background(self, client, db, login, runner):
+        """Test that an export is queued, runs and has a downloadable result."""
+        login()
+        db.session.add(Item(description='tent'))
+        db.session.commit()
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 3})
+
+        response = client.post('/api/jobs', json={'kind': 'export_transactions'})
+        assert response.status_code == 202
+        job_id = response.get_json()['id']
+        assert self._wait(client, job_id)['status'] == 'succeeded'
+
+        result = client.get(f'/api/jobs/{job_id}/result')
+        assert result.status_code == 200
+        assert result.mimetype == 'text/csv'
+        lines = result.get_data(as_text=True).splitlines()
+        assert lines[0].startswith('tid,date,item')
+        assert ',tent,leader,purchase,3,' in lines[1]
+
+    def test_running_job_can_be_cancelled(self, client, db, login, runner):
+        """Test that a running job stops at its next checkpoint."""
+        from jobs import JobKind
+        import threading
+        started = threading.Event()
+
+        def endless(params, path, checkpoint):
+            started.set()
+            while True:
+                checkpoint()
+
+        login()
+        with patch.dict('jobs.JOB_KINDS', {'endless': JobKind(endless, None, None, False)}):
+            job_id = client.post('/api/jobs', json={'kind': 'endless'}).get_json()['id']
+            assert started.wait(5)
+            assert client.post(f'/api/jobs/{job_id}/cancel').status_code == 202
+            assert self._wait(client, job_id)['status'] == 'cancelled'
+        assert client.get(f'/api/jobs/{job_id}/result').status_code == 409
+
+    def test_admin_jobs_and_invalid_kinds(self, client, db, login, runner):
+        """Test that admin-only kinds and unknown kinds are rejected."""
+        login()
+        assert client.post('/api/jobs', json={'kind': 'rebuild_aggregates'}).status_code == 403
+        assert client.post('/api/jobs', json={'kind': 'format_disk'}).status_code == 400
+
+    def test_interrupted_jobs_are_failed(self, client, db, login):
+        """Test that jobs left behind by a stopped server are marked as failed."""
+        from jobs import fail_interrupted_jobs
+        from models import Job
+        user = login()
+        db.session.add(Job(kind='usage_report', uid=user.uid, status='running'))
+        db.session.commit()
+        assert fail_interrupted_jobs() == 1
+        assert Job.query.one().status == 'failed'
+
+    def test_job_without_heartbeat_is_failed_on_read(self, client, db, login):
+        """Test that a job whose runner stopped refreshing its heartbeat is failed when it is read."""
+        from datetime import datetime, timedelta
+        from models import Job
+        user = login()
+        stale = datetime.now() - timedelta(minutes=5)
+        db.session.add(Job(kind='usage_report', uid=user.uid, status='running', heartbeat_at=stale))
+        db.session.add(Job(kind='usage_report', uid=user.uid, status='running', heartbeat_at=datetime.now()))
+        db.session.commit()
+
+        job = client.get('/api/jobs/1').get_json()
+        assert job['status'] == 'failed'
+        assert job['error'] == 'The worker running the job stopped'
+        assert client.get('/api/jobs/2').get_json()['status'] == 'running'
+
+    def test_heartbeat_keeps_running_jobs_alive(self, app, client, db, login, runner):
+        """Test that the runner refreshes the heartbeat of the jobs it is running."""
+        from jobs import JobKind
+        from models import Job
+        import threading
+        import time
+        started, release = threading.Event(), threading.Event()
+
+        def waiting(params, path, checkpoint):
+            started.set()
+            release.wait(5)
+
+        runner.heartbeat = 0.01
+        login()
+        with patch.dict('jobs.JOB_KINDS', {'waiting': JobKind(waiting, None, None, False)}):
+            job_id = client.post('/api/jobs', json={'kind': 'waiting'}).get_json()['id']
+            assert started.wait(5)
+            submitted = db.session.get(Job, job_id).heartbeat_at
+            time.sleep(0.1)
+            db.session.expire_all()
+            assert db.session.get(Job, job_id).heartbeat_at > submitted
+            release.set()
+            assert self._wait(client, job_id)['status'] == 'succeeded'
+
+    def test_expired_results_are_deleted(self, app, client, db, login, runner):
+        """Test that result files are deleted once they are older than JOB_RESULT_TTL_SECONDS."""
+        from models import Job
+        import os
+        login()
+        job_id = client.post('/api/jobs', json={'kind': 'usage_report'}).get_json()['id']
+        assert self._wait(client, job_id)['status'] == 'succeeded'
+        path = db.session.get(Job, job_id).result_path
+        assert os.path.exists(path)
+
+        app.config['JOB_RESULT_TTL_SECONDS'] = 0
+        client.post('/api/jobs', json={'kind': 'usage_report'})
+        assert not os.path.exists(path)
+        assert client.get(f'/api/jobs/{job_id}/result').status_code == 410
+
+
+class TestBulkItems:
+    """Test reading several items at once."""
+
+    def _setup(self, client, db):
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        for description in ('tent', 'axe', 'rope'):
+            db.session.add(Item(description=description))
+        db.session.commit()
+        for quantity in (1, 2, 3):
+            client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': quantity})
+        client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 2})
+
+    def test_items_by_description(self, client, db):
+        """Test that items are returned keyed by description with stock and recent transactions."""
+        self._setup(client, db)
+        data = client.post('/api/items?recent=2', json={'descriptions': ['tent', 'axe', 'stove']}).get_json()
+        assert data['count'] == 2
+        assert data['missing'] == ['stove']
+        tent = data['items']['tent']
+        assert (tent['quantity'], tent['loaned'], tent['available']) == (6, 2, 4)
+        assert [t['transaction_type'] for t in tent['transaction_list']] == ['borrow', 'purchase']
+        assert data['items']['axe']['transaction_list'] == []
+
+    def test_items_by_id(self, client, db):
+        """Test that items can be asked for by id."""
+        self._setup(client, db)
+        data = client.post('/api/items', json={'ids': [1, 3]}).get_json()
+        assert sorted(data['items']) == ['1', '3']
+        assert len(data['items']['1']['transaction_list']) == 4
+
+    def test_query_count_does_not_grow_with_items(self, client, db):
+        """Test that a batch is read in a fixed number of queries."""
+        from sqlalchemy import event
+        self._setup(client, db)
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            client.post('/api/items', json={'descriptions': ['tent']})
+            one = len(statements)
+            statements.clear()
+            client.post('/api/items', json={'descriptions': ['tent', 'axe', 'rope']})
+            assert len(statements) == one
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+
+    def test_invalid_batches(self, client, db):
+        """Test that malformed batches are rejected."""
+        self._setup(client, db)
+        assert client.post('/api/items', json={}).status_code == 400
+        assert client.post('/api/items', json={'ids': ['tent']}).status_code == 400
+        assert client.post('/api/items', json={'ids': [True]}).status_code == 400
+
+
+class TestPermissionCache:
+    """Test the cached permission checks."""
+
+    def test_repeated_checks_do_not_query_users(self, client, db, login):
+        """Test that only the first permission check of a user reads the users table."""
+        from sqlalchemy import event
+        login(edit_permission=True)
+        db.session.expunge_all()
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            for _ in range(3):
+                assert client.get('/api/loans').status_code == 200
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        assert len([statement for statement in statements if statement.startswith('SELECT users.')]) == 1
+
+    def test_permission_change_is_seen_after_commit(self, client, db, login):
+        """Test that revoking a permission in this worker takes effect immediately."""
+        user = login(edit_permission=True)
+        assert client.get('/api/loans').status_code == 200
+        user.edit_permission = False
+        db.session.commit()
+        assert client.get('/api/loans').status_code == 403
+
+    def test_cache_entries_expire(self, client, db, login):
+        """Test that claims are reloaded after the TTL."""
+        import time
+        from permissions import users
+        login(edit_permission=False)
+        assert client.get('/api/loans').status_code == 403
+        db.session.execute(db.text('UPDATE users SET edit_permission = 1'))
+        db.session.commit()
+        assert client.get('/api/loans').status_code == 403
+        db.session.expunge_all()
+        with patch('permissions.time.monotonic', return_value=time.monotonic() + users.ttl + 1):
+            assert client.get('/api/loans').status_code == 200
+
+
+class TestBackup:
+    """Test online backups of the SQLite database."""
+
+    def _database(self, tmp_path, rows=200, name='inventory.db'):
+        import sqlite3
+        path = str(tmp_path / name)
+        connection = sqlite3.connect(path)
+        connection.execute('CREATE TABLE IF NOT EXISTS items (iid INTEGER PRIMARY KEY, description TEXT)')
+        connection.executemany('INSERT INTO items (description) VALUES (?)', [('x' * 200,)] * rows)
+        connection.commit()
+        connection.close()
+        return path
+
+    def _descriptions(self, path):
+        import sqlite3
+        connection = sqlite3.connect(path)
+        try:
+            return connection.execute('SELECT count(*), max(description) FROM items').fetchone()
+        finally:
+            connection.close()
+
+    def test_incremental_backup_restores_current_state(self, tmp_path):
+        """Test that a full backup plus a differential backup restores the latest data."""
+        from backup import backup_database, restore_backup
+        import sqlite3
+        source = self._database(tmp_path)
+        directory = str(tmp_path / 'backups')
+        full, full_pages = backup_database(source, directory)
+
+        connection = sqlite3.connect(source)
+        connection.execute("INSERT INTO items (description) VALUES ('zzz')")
+        connection.commit()
+        connection.close()
+
+        diff, diff_pages = backup_database(source, directory, incremental=True)
+        assert diff.endswith('.diff.gz') and full.endswith('.db.gz')
+        assert 0 < diff_pages < full_pages
+
+        restored = str(tmp_path / 'restored.db')
+        restore_backup(full, restored, diff)
+        assert self._descriptions(restored) == self._descriptions(source) == (201, 'zzz')
+
+    def test_backup_finishes_under_steady_writes(self, tmp_path):
+        """Test that the copy is one consistent snapshot and does not restart while another connection writes."""
+        from backup import backup_database, restore_backup
+        import sqlite3
+        import threading
+        source = self._database(tmp_path, rows=2000)
+        stop = threading.Event()
+
+        def write():
+            connection = sqlite3.connect(source)
+            connection.execute('PRAGMA journal_mode=WAL')
+            while not stop.is_set():
+                connection.execute("INSERT INTO items (description) VALUES ('w')")
+                connection.commit()
+            connection.close()
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            full, pages = backup_database(source, str(tmp_path / 'backups'))
+        finally:
+            stop.set()
+            writer.join()
+
+        restored = str(tmp_path / 'restored.db')
+        restore_backup(full, restored)
+        assert self._descriptions(restored)[0] >= 2000
+
+    def test_rotation_keeps_newest_full_backups(self, tmp_path):
+        """Test that only the newest full backups and their manifests are kept."""
+        from backup import backup_database, full_backups
+        import os
+        source = self._database(tmp_path)
+        directory = str(tmp_path / 'backups')
+        paths = [backup_database(source, directory, keep=2)[0] for _ in range(3)]
+        assert full_backups(directory, 'inventory') == paths[1:]
+        assert len([entry for entry in os.listdir(directory) if entry.endswith('.pages.json')]) == 2
+
+    def test_rotation_with_dotted_database_name(self, tmp_path):
+        """Test that dots in the database name do not make rotation delete the kept backups."""
+        from backup import backup_database, full_backups
+        import os
+        source = self._database(tmp_path, name='inv.prod.db')
+        directory = str(tmp_path / 'backups')
+        paths = [backup_database(source, directory, keep=2)[0] for _ in range(3)]
+        diff = backup_database(source, directory, incremental=True, keep=2)[0]
+        assert full_backups(directory, 'inv.prod') == paths[1:]
+        assert os.path.exists(diff)
+
+    def test_diff_must_match_its_full_backup(self, tmp_path):
+        """Test that a differential backup is not applied to another full backup."""
+        from backup import backup_database, restore_backup
+        source = self._database(tmp_path)
+        directory = str(tmp_path / 'backups')
+        older, _ = backup_database(source, directory)
+        backup_database(source, directory)
+        diff, _ = backup_database(source, directory, incremental=True)
+        with pytest.raises(ValueError):
+            restore_backup(older, str(tmp_path / 'restored.db'), diff)
+
+    def test_only_sqlite_files_can_be_backed_up(self):
+        """Test that in-memory and server databases are refused."""
+        from backup import sqlite_database_path
+        from sqlalchemy.engine import make_url
+        with pytest.raises(ValueError):
+            sqlite_database_path(make_url('sqlite:///:memory:'))
+        with pytest.raises(ValueError):
+            sqlite_database_path(make_url('postgresql://localhost/inventory'))
+        assert sqlite_database_path(make_url('sqlite:///./inventory.db')) == './inventory.db'
+
+
+class TestItemKeys:
+    """Test the normalized item lookup key."""
+
+    def test_normalize_key(self):
+        """Test that case, surrounding and repeated whitespace and Unicode forms are folded."""
+        from models import normalize_key
+        assert normalize_key('  Tent \t Stake ') == 'tent stake'
+        assert normalize_key('ＴＥＮＴ') == 'tent'
+        assert normalize_key('Straße') == normalize_key('STRASSE')
+
+    def test_mixed_case_items_can_be_found(self, client, db, login):
+        """Test that items added with capitals can be used in transactions and lookups."""
+        login()
+        client.post('/api/add_item', json={'description': 'Tent Stake'})
+        assert client.post('/api/add_item', json={'description': 'tent  stake'}).status_code == 400
+        response = client.post('/api/transaction/purchase', json={'item_description': 'TENT STAKE', 'quantity': 2})
+        assert response.status_code == 200
+        assert len(client.get('/api/item/tent stake').get_json()['transaction_list']) == 1
+        assert Item.query.one().description == 'Tent Stake'
+
+    def test_lookup_is_an_index_search(self, db):
+        """Test that looking an item up by key uses the unique index."""
+        plan = db.session.execute(db.text("EXPLAIN QUERY PLAN SELECT * FROM items WHERE key = 'tent'")).all()
+        assert 'USING INDEX' in plan[0][-1]
+
+    def test_backfill_merges_duplicates(self, client, db):
+        """Test that existing rows get their key and duplicates are merged into the oldest item."""
+        from item_keys import normalize_items
+        from models import Transaction
+        db.session.execute(db.text(
+            "INSERT INTO items (iid, description, version, available) VALUES (1, 'Tent', 0, 3), (2, 'tent ', 0, 2), (3, 'Axe', 0, 0)"
+        ))
+        db.session.execute(db.text(
+            "INSERT INTO transations (iid, uid, transaction_type, quantity, date, compacted) VALUES "
+            "(1, 1, 'purchase', 3, '2024-01-01 00:00:00', 0), (2, 1, 'purchase', 2, '2024-01-02 00:00:00', 0)"
+        ))
+        db.session.commit()
+
+        assert normalize_items() == (2, 1)
+        db.session.expire_all()
+        items = {item.key: item for item in Item.query}
+        assert sorted(items) == ['axe', 'tent']
+        assert items['tent'].iid == 1 and items['tent'].available == 5
+        assert {transaction.iid for transaction in Transaction.query} == {1}
+        assert normalize_items() == (0, 0)
+
+    def test_merge_keeps_usage_of_compacted_days(self, db):
+        """Test that a duplicate's daily usage moves to the survivor, summed with the survivor's own days."""
+        from item_keys import normalize_items
+        from models import DailyUsage
+        db.session.execute(db.text(
+            "INSERT INTO items (iid, description, version, available) VALUES (1, 'Tent', 0, 4), (2, 'tent ', 0, 3)"
+        ))
+        # carry-forward rows of a compaction, dated on the newest day of their group
+        db.session.execute(db.text(
+            "INSERT INTO transations (iid, uid, transaction_type, quantity, date, compacted) VALUES "
+            "(1, 1, 'purchase', 4, '2020-07-01 00:00:00', 1), (2, 1, 'purchase', 3, '2020-07-01 00:00:00', 1)"
+        ))
+        db.session.execute(db.text(
+            "INSERT INTO daily_usage (iid, day, transaction_type, quantity) VALUES "
+            "(1, '2020-07-01', 'purchase', 4), (2, '2020-06-01', 'purchase', 2), (2, '2020-07-01', 'purchase', 1)"
+        ))
+        db.session.commit()
+
+        normalize_items()
+        usage = sorted((row.iid, row.day, row.quantity) for row in DailyUsage.query)
+        assert usage == [(1, date(2020, 6, 1), 2), (1, date(2020, 7, 1), 5)]
+
+
+class TestReadPath:
+    """Test that read requests load plain rows into a read-only session."""
+
+    @pytest.fixture
+    def observed(self, app, client, db):
+        from sessions import register_read_routing
+        register_read_routing(app, db)
+        observed = {}
+
+        @app.after_request
+        def observe_session(response):
+            # the session itself, the scoped_session proxy does not forward every attribute
+            session = db.session()
+            observed['autoflush'] = session.autoflush
+            observed['expire_on_commit'] = session.expire_on_commit
+            observed['loaded'] = {type(obj).__name__ for obj in session.identity_map.values()}
+            return response
+        with client.session_transaction() as sess:
+            sess['user_id'] = 1
+        return observed
+
+    def test_read_session_does_not_flush_or_expire(self, client, observed):
+        """Test that GET sessions skip autoflush and expiry and POST sessions keep them."""
+        client.get('/api/get_inventory')
+        assert observed['autoflush'] is False and observed['expire_on_commit'] is False
+        client.post('/api/add_item', json={'description': 'tent'})
+        assert observed['autoflush'] is True and observed['expire_on_commit'] is True
+
+    def test_reads_do_not_hydrate_models(self, client, observed):
+        """Test that inventory and item history are served without loading model instances."""
+        client.post('/api/add_item', json={'description': 'tent'})
+        client.post('/api/transaction/purchase', json={'item_description': 'tent', 'quantity': 2})
+        client.post('/api/transaction/borrow', json={'item_description': 'tent', 'quantity': 1})
+
+        response = client.get('/api/item/tent')
+        assert len(response.get_json()['transaction_list']) == 2
+        assert observed['loaded'] == set()
+
+        response = client.get('/api/get_inventory')
+        assert response.get_json()['count'] == 1
+        assert observed['loaded'] == set()
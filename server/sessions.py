@@ -0,0 +1,63 @@
+from flask import request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+READ_BIND = 'read'
+READ_METHODS = ('GET', 'HEAD')
+
+class RoutingSession(Session):
+    """
+    Session that sends the queries of read-only requests to the read-only engine.
+    Flushes always go to the primary, so a read request that writes by accident
+    still writes to the right database.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_only') and not self._flushing:
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def read_only_uri(uri):
+    """
+    Derives a read-only URI for a file based SQLite database, or returns None.
+    """
+    url = make_url(uri)
+    if not url.drivername.startswith('sqlite') or url.database in (None, '', ':memory:'):
+        return None
+    if url.query.get('uri'):
+        return None
+    return f"sqlite:///file:{url.database}?mode=ro&uri=true"
+
+def enable_wal(dbapi_connection, connection_record):
+    # readers on WAL never block the writer and never take write locks themselves
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.close()
+
+def mark_read_only(db, read_only=True):
+    """
+    Marks the current session as read-only or read-write. Read-only sessions neither
+    autoflush nor expire on commit, since they have nothing to flush, and their queries
+    go to the read-only engine when one is configured.
+    """
+    # the scoped_session proxy only forwards some attributes, set them on the session itself
+    session = db.session()
+    session.info['read_only'] = read_only
+    session.autoflush = not read_only
+    session.expire_on_commit = not read_only
+
+def register_read_routing(app, db):
+    """
+    Marks the session of GET and HEAD requests as read-only, see mark_read_only.
+    """
+    if READ_BIND in app.config.get('SQLALCHEMY_BINDS', {}):
+        with app.app_context():
+            if db.engine.dialect.name == 'sqlite':
+                event.listen(db.engine, 'connect', enable_wal)
+
+    @app.before_request
+    def route_reads():
+        # set on every request: outside of gunicorn the session may outlive a request
+        mark_read_only(db, request.method in READ_METHODS)
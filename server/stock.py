@@ -0,0 +1,288 @@
+from app import db
+from models import Item, Transaction, StockSnapshot, LoanBalance, DailyUsage, Counter, LocationStock, TRANSACTION_TYPES
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, case, update, select
+from sqlalchemy.dialects import postgresql, sqlite
+from events import queue_event
+
+# effect of one unit of each transaction type on Item.available
+AVAILABLE_DELTA = {
+    'borrow': -1,
+    'return': 1,
+    'purchase': 1,
+    'dispose': -1,
+}
+
+class InsufficientStock(Exception):
+    pass
+
+class NothingOnLoan(InsufficientStock):
+    pass
+
+# maps a transaction type to the StockSnapshot column holding its total
+SNAPSHOT_COLUMNS = {
+    'borrow': 'borrowed',
+    'return': 'returned',
+    'purchase': 'purchased',
+    'dispose': 'disposed',
+}
+
+# snapshot columns in SNAPSHOT_COLUMNS order, for column-only reads
+SNAPSHOT_TOTALS = tuple(getattr(StockSnapshot, column) for column in SNAPSHOT_COLUMNS.values())
+
+def empty_totals():
+    return dict.fromkeys(TRANSACTION_TYPES, 0)
+
+def parse_as_of(value):
+    """
+    Parses an ISO date or datetime. A bare date means the end of that day.
+    Raises ValueError when the value is not a valid ISO date.
+    """
+    if len(value) == 10:
+        return datetime.combine(date.fromisoformat(value), time.max)
+    return datetime.fromisoformat(value)
+
+def latest_snapshot(as_of=None):
+    """
+    Returns (taken_at, last_tid) of the newest checkpoint taken at or before as_of,
+    or (None, 0) when there is none.
+    """
+    query = db.session.query(func.max(StockSnapshot.taken_at))
+    if as_of is not None:
+        query = query.filter(StockSnapshot.taken_at <= as_of)
+    taken_at = query.scalar()
+    if taken_at is None:
+        return None, 0
+
+    last_tid = db.session.query(StockSnapshot.last_tid).filter_by(taken_at=taken_at).limit(1).scalar()
+    return taken_at, last_tid
+
+def stock_totals(as_of=None, upto_tid=None, iids=None):
+    """
+    Computes the per-item transaction totals at as_of (or now), optionally only for iids.
+    The totals start from the nearest earlier snapshot and only add the transactions
+    written after it, so the cost does not grow with the age of the data.
+    Returns a dict mapping iid to a dict of totals per transaction type.
+    """
+    totals = {}
+    taken_at, last_tid = latest_snapshot(as_of)
+
+    if taken_at is not None:
+        snapshots = select(StockSnapshot.iid, *SNAPSHOT_TOTALS).where(StockSnapshot.taken_at == taken_at)
+        if iids is not None:
+            snapshots = snapshots.where(StockSnapshot.iid.in_(iids))
+        for iid, *item_totals in db.session.execute(snapshots):
+            totals[iid] = dict(zip(SNAPSHOT_COLUMNS, item_totals))
+
+    delta = db.session.query(
+        Transaction.iid,
+        Transaction.transaction_type,
+        func.sum(Transaction.quantity)
+    ).filter(Transaction.tid > last_tid)
+    if as_of is not None:
+        delta = delta.filter(Transaction.date <= as_of)
+    if upto_tid is not None:
+        delta = delta.filter(Transaction.tid <= upto_tid)
+    if iids is not None:
+        delta = delta.filter(Transaction.iid.in_(iids))
+
+    for iid, transaction_type, quantity in delta.group_by(Transaction.iid, Transaction.transaction_type):
+        totals.setdefault(iid, empty_totals())[transaction_type] += quantity or 0
+
+    return totals
+
+def location_totals(lid):
+    """
+    Reads the current per-item transaction totals of one location from its running
+    aggregates, a range read on the lid-leading primary key.
+    Returns a dict mapping iid to a dict of totals per transaction type.
+    """
+    totals = select(LocationStock.iid, *(getattr(LocationStock, column) for column in SNAPSHOT_COLUMNS.values())) \
+        .where(LocationStock.lid == lid)
+    return {iid: dict(zip(SNAPSHOT_COLUMNS, item_totals)) for iid, *item_totals in db.session.execute(totals)}
+
+def take_snapshot(taken_at=None):
+    """
+    Checkpoints the current totals of every item that has transactions.
+    Builds on the previous snapshot, so only the transactions since then are read.
+    Returns the number of snapshot rows written.
+    """
+    taken_at = taken_at or datetime.now()
+    last_tid = db.session.query(func.max(Transaction.tid)).scalar() or 0
+    totals = stock_totals(upto_tid=last_tid)
+
+    for iid, item_totals in totals.items():
+        snapshot = StockSnapshot(taken_at=taken_at, last_tid=last_tid, iid=iid)
+        for transaction_type, column in SNAPSHOT_COLUMNS.items():
+            setattr(snapshot, column, item_totals[transaction_type])
+        db.session.add(snapshot)
+    db.session.commit()
+
+    return len(totals)
+
+def increment(model, keys, **amounts):
+    """
+    Adds amounts to the counter columns of the row identified by keys, creating it when missing.
+    Runs as a single atomic upsert, so concurrent workers never lose an update.
+    """
+    if db.session.get_bind().dialect.name == 'postgresql':
+        insert = postgresql.insert
+    else:
+        insert = sqlite.insert
+
+    table = model.__table__
+    statement = insert(table).values(**keys, **amounts)
+    statement = statement.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={column: table.c[column] + statement.excluded[column] for column in amounts}
+    )
+    db.session.execute(statement)
+
+def current_version(name='inventory'):
+    return db.session.query(Counter.value).filter_by(name=name).scalar() or 0
+
+def next_version(name='inventory'):
+    """
+    Atomically increments and returns the named data version.
+    The increment takes the row's write lock, so concurrent writers get distinct versions.
+    """
+    increment(Counter, {'name': name}, value=1)
+    return current_version(name)
+
+def record_transaction(transaction):
+    """
+    Applies a new transaction to the incrementally maintained aggregates.
+    Must be called in the same database transaction as the insert, which the caller
+    has to roll back when InsufficientStock is raised.
+    """
+    # flushing assigns the tid and the default date the aggregates are keyed on
+    db.session.flush()
+
+    if transaction.transaction_type == 'return':
+        # returns must match units the user has on loan, or they would create stock from nothing
+        statement = update(LoanBalance).where(
+            LoanBalance.uid == transaction.uid,
+            LoanBalance.iid == transaction.iid,
+            LoanBalance.outstanding >= transaction.quantity
+        ).values(outstanding=LoanBalance.outstanding - transaction.quantity)
+        result = db.session.execute(statement, execution_options={'synchronize_session': False})
+        if result.rowcount == 0:
+            raise NothingOnLoan(f"User {transaction.uid} has fewer than {transaction.quantity} of item {transaction.iid} on loan")
+
+    # one conditional UPDATE both checks and takes the stock, so concurrent workers cannot oversell
+    delta = AVAILABLE_DELTA[transaction.transaction_type] * transaction.quantity
+    statement = update(Item).where(Item.iid == transaction.iid) \
+        .values(available=Item.available + delta, version=next_version())
+    if delta < 0:
+        statement = statement.where(Item.available >= -delta)
+    result = db.session.execute(statement, execution_options={'synchronize_session': False})
+    if result.rowcount == 0:
+        raise InsufficientStock(f"Not enough stock to {transaction.transaction_type} {transaction.quantity}")
+    if transaction.lid is not None:
+        record_location_stock(transaction, delta)
+    day = transaction.date.date() if isinstance(transaction.date, datetime) else transaction.date
+
+    increment(DailyUsage, {
+        'iid': transaction.iid,
+        'day': day,
+        'transaction_type': transaction.transaction_type
+    }, quantity=transaction.quantity)
+
+    if transaction.transaction_type == 'borrow':
+        increment(LoanBalance, {'uid': transaction.uid, 'iid': transaction.iid}, outstanding=transaction.quantity)
+
+    queue_event(stock_delta(transaction))
+
+def record_location_stock(transaction, delta):
+    """
+    Applies a transaction to the running totals of its location, with the same
+    conditional UPDATE stock check as the item-wide counter.
+    """
+    column = SNAPSHOT_COLUMNS[transaction.transaction_type]
+    if delta > 0:
+        increment(LocationStock, {'lid': transaction.lid, 'iid': transaction.iid},
+                  available=delta, **{column: transaction.quantity})
+        return
+
+    statement = update(LocationStock).where(
+        LocationStock.lid == transaction.lid,
+        LocationStock.iid == transaction.iid,
+        LocationStock.available >= -delta
+    ).values({column: getattr(LocationStock, column) + transaction.quantity, 'available': LocationStock.available + delta})
+    result = db.session.execute(statement, execution_options={'synchronize_session': False})
+    if result.rowcount == 0:
+        raise InsufficientStock(f"Not enough stock at location {transaction.lid} to {transaction.transaction_type} {transaction.quantity}")
+
+def stock_delta(transaction):
+    """
+    Describes the effect of a transaction on the quantity and loaned figures of get_inventory.
+    """
+    item = db.session.get(Item, transaction.iid)
+    return {
+        'event': 'stock',
+        'tid': transaction.tid,
+        'iid': transaction.iid,
+        'lid': transaction.lid,
+        'description': item.description if item else None,
+        'transaction_type': transaction.transaction_type,
+        'quantity_delta': {'purchase': transaction.quantity, 'dispose': -transaction.quantity}.get(transaction.transaction_type, 0),
+        'loaned_delta': transaction.quantity if transaction.transaction_type == 'borrow' else 0,
+        'available_delta': AVAILABLE_DELTA[transaction.transaction_type] * transaction.quantity,
+    }
+
+def rebuild_aggregates():
+    """
+    Recomputes every incrementally maintained aggregate from the transaction log.
+    Daily usage is only recomputed for the days after the newest compacted transaction,
+    the transaction log no longer holds the per-day quantities of earlier days.
+    """
+    outstanding = func.sum(case(
+        (Transaction.transaction_type == 'borrow', Transaction.quantity),
+        (Transaction.transaction_type == 'return', -Transaction.quantity),
+        else_=0
+    ))
+    balances = db.session.query(Transaction.uid, Transaction.iid, outstanding).filter(
+        Transaction.transaction_type.in_(('borrow', 'return'))
+    ).group_by(Transaction.uid, Transaction.iid).all()
+
+    totals = stock_totals()
+    location_usage = db.session.query(Transaction.lid, Transaction.iid, Transaction.transaction_type, func.sum(Transaction.quantity)) \
+        .filter(Transaction.lid.isnot(None)) \
+        .group_by(Transaction.lid, Transaction.iid, Transaction.transaction_type).all()
+    # compaction moves the quantity of folded rows to the newest date of their group, so the
+    # days up to the newest carry-forward row keep the rollup recorded when they happened
+    compacted_until = db.session.query(func.max(Transaction.date)).filter(Transaction.compacted).scalar()
+    day = func.date(Transaction.date)
+    usage = db.session.query(Transaction.iid, day, Transaction.transaction_type, func.sum(Transaction.quantity))
+    if compacted_until is not None:
+        compacted_until = compacted_until.date()
+        usage = usage.filter(Transaction.date >= datetime.combine(compacted_until + timedelta(days=1), time.min))
+    usage = usage.group_by(Transaction.iid, day, Transaction.transaction_type).all()
+
+    LoanBalance.query.delete()
+    db.session.add_all(LoanBalance(uid=uid, iid=iid, outstanding=total) for uid, iid, total in balances)
+
+    for item in Item.query.all():
+        item_totals = totals.get(item.iid, empty_totals())
+        item.available = item_totals['purchase'] - item_totals['dispose'] - item_totals['borrow'] + item_totals['return']
+
+    LocationStock.query.delete()
+    location_stock = {}
+    for lid, iid, transaction_type, total in location_usage:
+        stock = location_stock.setdefault((lid, iid), LocationStock(lid=lid, iid=iid, borrowed=0, returned=0, purchased=0, disposed=0))
+        setattr(stock, SNAPSHOT_COLUMNS[transaction_type], total)
+    for stock in location_stock.values():
+        stock.available = stock.purchased - stock.disposed - stock.borrowed + stock.returned
+    db.session.add_all(location_stock.values())
+
+    rollups = DailyUsage.query
+    if compacted_until is not None:
+        rollups = rollups.filter(DailyUsage.day > compacted_until)
+    rollups.delete()
+    db.session.add_all(
+        # SQLite returns date() as an ISO string
+        DailyUsage(iid=iid, day=date.fromisoformat(day) if isinstance(day, str) else day,
+                   transaction_type=transaction_type, quantity=total)
+        for iid, day, transaction_type, total in usage
+    )
+    db.session.commit()